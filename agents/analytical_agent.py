@@ -9,6 +9,7 @@ from typing import Dict, Any, Optional, Tuple
 from anthropic import Anthropic
 import pandas as pd
 from utils.logger import setup_logger
+from core.sql_generator import _FROM_TABLE_RE
 
 logger = setup_logger(__name__, "INFO")
 
@@ -141,13 +142,13 @@ class AnalyticalAgent:
                     logger.info(f"Retrying SQL generation with error feedback: {last_error}")
                     sql_query = self.sql_generator.generate_query_with_error(
                         user_query, last_sql, str(last_error), conversation_context,
-                        tried_tables=tried_tables
+                        tried_tables=tried_tables, attempt=attempt
                     )
                 last_sql = sql_query
                 logger.info(f"Generated SQL: {sql_query[:100]}...")
 
                 # Track which schema.table was used in this attempt
-                for m in re.finditer(r'FROM\s+([\w]+)\.([\w]+)', sql_query, re.IGNORECASE):
+                for m in _FROM_TABLE_RE.finditer(sql_query):
                     tried_tables.add(f"{m.group(1)}.{m.group(2)}")
                 if tried_tables:
                     logger.info("Tried tables so far: %s", ", ".join(sorted(tried_tables)))
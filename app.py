@@ -29,11 +29,14 @@ except ValueError as e:
 app = Flask(__name__)
 
 # Initialize core components
-schema_loader = SchemaLoader(Config.DOCS_DIR)
+schema_loader = SchemaLoader(Config.DOCS_DIR, Config.SCHEMA_CACHE_PATH)
 schema_docs = schema_loader.load_all()
 
-sql_generator = SQLGenerator(Config.ANTHROPIC_API_KEY, Config.ANTHROPIC_MODEL)
-sql_generator.set_schema(schema_docs)
+sql_generator = SQLGenerator(
+    Config.ANTHROPIC_API_KEY, Config.ANTHROPIC_MODEL,
+    Config.ANTHROPIC_RETRY_MODEL, Config.ANTHROPIC_FAST_MODEL
+)
+sql_generator.set_schema(schema_docs, schema_loader.get_signature())
 
 db_manager = DatabaseManager(
     host=Config.DB_HOST,
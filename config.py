@@ -15,10 +15,13 @@ class Config:
     # Base paths
     BASE_DIR = Path(__file__).parent
     DOCS_DIR = BASE_DIR / "docs"
+    SCHEMA_CACHE_PATH = Path(os.getenv("SCHEMA_CACHE_PATH", Path.home() / ".cache" / "hj-mcp" / "schema.pkl"))
 
     # Anthropic Configuration
     ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
     ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929")
+    ANTHROPIC_RETRY_MODEL = os.getenv("ANTHROPIC_RETRY_MODEL", "claude-haiku-4-5")
+    ANTHROPIC_FAST_MODEL = os.getenv("ANTHROPIC_FAST_MODEL", "claude-haiku-4-5")
 
     # Slack Configuration
     SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
@@ -30,6 +33,7 @@ class Config:
     DB_USER = os.getenv("DB_USER")
     DB_PASSWORD = os.getenv("DB_PASSWORD")
     DB_PORT = int(os.getenv("DB_PORT", "5432"))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "16"))
 
     # Application Configuration
     FLASK_PORT = int(os.getenv("FLASK_PORT", "3000"))
@@ -39,6 +43,8 @@ class Config:
     # MCP Server Configuration
     MCP_SERVER_NAME = os.getenv("MCP_SERVER_NAME", "herojourney-sql-assistant")
     MCP_SERVER_VERSION = os.getenv("MCP_SERVER_VERSION", "1.0.0")
+    # Threads for concurrent LLM generation in MCP tool calls
+    MCP_WORKER_THREADS = int(os.getenv("MCP_WORKER_THREADS", "32"))
 
     @classmethod
     def validate(cls):
@@ -1,20 +1,52 @@
 """
 Database connection and query execution.
 """
+import threading
+import time
+from datetime import date
 import psycopg2
 import pandas as pd
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, List, Tuple
 from contextlib import contextmanager
 from utils.logger import setup_logger
+from utils.sql_guard import check_select_sql
 
 logger = setup_logger(__name__)
 
 
+def _bounded_sql(sql: str, cap: int) -> str:
+    """
+    Wrap a SELECT so the server stops after `cap` rows.
+
+    Wrapping (instead of appending LIMIT) keeps any LIMIT/ORDER BY of the
+    original query intact; the newline protects against a trailing -- comment.
+    The query must already have passed check_select_sql(), otherwise it could
+    close the subquery and append statements of its own.
+
+    Args:
+        sql: Single SELECT statement without the trailing ';'
+        cap: Max number of rows to return
+
+    Returns:
+        Bounded SQL string
+    """
+    return f"SELECT * FROM (\n{sql}\n) AS _bounded LIMIT {int(cap)}"
+
+
 class DatabaseManager:
     """Manages PostgreSQL database connections and query execution."""
 
+    # Column lists change on the order of days; cache them for an hour
+    COLUMNS_CACHE_TTL = 3600
+    # Idle connections kept open for reuse; more concurrent callers still get
+    # their own connection, which is closed afterwards
+    POOL_MAX_CONNECTIONS = 10
+    # Connections idle longer than this are pinged before reuse, since the server,
+    # a proxy or a failover may have dropped them in the meantime
+    POOL_PING_AFTER = 30
+
     def __init__(self, host: str, dbname: str, user: str, password: str, port: int = 5432,
-                 query_timeout: int = 60):
+                 query_timeout: int = 60, pool_max_size: int = POOL_MAX_CONNECTIONS):
         """
         Initialize database manager.
 
@@ -25,6 +57,7 @@ class DatabaseManager:
             password: Database password
             port: Database port (default: 5432)
             query_timeout: Query timeout in seconds (default: 60)
+            pool_max_size: Max idle connections kept for reuse (default: POOL_MAX_CONNECTIONS)
         """
         self.config = {
             "host": host,
@@ -35,12 +68,21 @@ class DatabaseManager:
             "connect_timeout": 10  # Connection timeout
         }
         self.query_timeout = query_timeout
+        self.pool_max_size = pool_max_size
+        self._columns_cache = {}  # (schema, table) -> (expires_at, columns)
+        # (connection, released_at) waiting for reuse; filled as calls finish, so
+        # constructing the manager never connects
+        self._idle = []
+        self._idle_lock = threading.Lock()
 
     @contextmanager
     def get_connection(self):
         """
         Context manager for database connections.
 
+        Connections are reused between calls, saving the TCP/auth handshake per
+        query; uncommitted work is rolled back when the block exits.
+
         Yields:
             psycopg2 connection object
 
@@ -50,16 +92,61 @@ class DatabaseManager:
         """
         conn = None
         try:
-            conn = psycopg2.connect(**self.config)
-            logger.debug("Database connection established")
+            conn = self._acquire_connection()
             yield conn
         except psycopg2.Error as e:
             logger.error("Database connection error: %s", str(e))
             raise
         finally:
             if conn:
-                conn.close()
-                logger.debug("Database connection closed")
+                self._release_connection(conn)
+
+    def _acquire_connection(self):
+        """Take a live idle connection, or open a new one if none is left."""
+        while True:
+            with self._idle_lock:
+                if not self._idle:
+                    break
+                conn, released_at = self._idle.pop()
+            if conn.closed:
+                continue
+            if time.monotonic() - released_at < self.POOL_PING_AFTER or self._ping(conn):
+                return conn
+            conn.close()
+            logger.info("Dropped a dead idle database connection")
+        return psycopg2.connect(**self.config)
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        """Check that an idle connection still reaches the server."""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_connection(self, conn):
+        """
+        Keep a connection for reuse, up to pool_max_size idle ones; close the rest.
+
+        Args:
+            conn: Connection returned by _acquire_connection()
+        """
+        reusable = not conn.closed
+        if reusable:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if reusable:
+            with self._idle_lock:
+                if len(self._idle) < self.pool_max_size:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+        conn.close()
+        logger.debug("Database connection closed")
 
     def execute_query(self, sql: str) -> pd.DataFrame:
         """
@@ -79,9 +166,10 @@ class DatabaseManager:
 
         try:
             with self.get_connection() as conn:
-                # Set statement timeout to prevent long-running queries
+                # Set statement timeout to prevent long-running queries; LOCAL keeps it
+                # from leaking to the next user of the pooled connection
                 with conn.cursor() as cur:
-                    cur.execute(f"SET statement_timeout = '{self.query_timeout}s'")
+                    cur.execute(f"SET LOCAL statement_timeout = '{self.query_timeout}s'")
                     logger.debug("Set query timeout to %d seconds", self.query_timeout)
 
                 df = pd.read_sql(sql, conn)
@@ -98,6 +186,55 @@ class DatabaseManager:
             logger.error("Query execution failed: %s", str(e))
             raise
 
+    def execute_query_limited(self, sql: str, max_rows: int) -> Tuple[List[str], List[tuple]]:
+        """
+        Execute a read-only SELECT, fetching at most max_rows rows as plain tuples.
+
+        The limit is applied in the database and rows are read through a
+        server-side cursor, so a huge result set is neither transferred nor
+        materialized. Ask for one row more than you display to
+        find out whether the result was cut. Rows are not wrapped in a
+        DataFrame: callers that only render text don't need one.
+
+        The SQL is checked to be a single SELECT before connecting and runs in
+        a READ ONLY transaction, so it may come from users or the LLM.
+
+        Args:
+            sql: SQL SELECT query string
+            max_rows: Max number of rows to fetch
+
+        Returns:
+            Tuple of (column names, list of row tuples)
+
+        Raises:
+            ValueError: If sql is not a single SELECT statement
+            psycopg2.Error: If query execution fails
+        """
+        statement = check_select_sql(sql)
+        logger.info("Executing SQL query (max %d rows)", max_rows)
+        logger.debug("SQL: %s", statement[:200])
+
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    # Data-modifying CTEs or SELECT INTO fail instead of writing
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    # LOCAL keeps the timeout from leaking to the next user of the pooled connection
+                    cur.execute(f"SET LOCAL statement_timeout = '{self.query_timeout}s'")
+                # Server-side cursor: rows are pulled in one bounded batch and the portal
+                # is closed after it, whatever the query (or a missing LIMIT) would yield
+                with conn.cursor(name="bounded_fetch") as cur:
+                    cur.execute(_bounded_sql(statement, max_rows))
+                    rows = cur.fetchmany(max_rows)
+                    columns = [desc[0] for desc in cur.description]
+
+            logger.info("Query executed successfully: %d rows, %d columns", len(rows), len(columns))
+            return columns, rows
+
+        except psycopg2.Error as e:
+            logger.error("Query execution failed: %s", str(e))
+            raise
+
     def test_connection(self) -> bool:
         """
         Test database connection.
@@ -196,6 +333,8 @@ class DatabaseManager:
         """
         Get real column names for a specific table from information_schema.
 
+        Non-empty results are cached for COLUMNS_CACHE_TTL seconds.
+
         Args:
             schema: Schema name (e.g. 'ods_core', 'stage')
             table: Table name
@@ -203,21 +342,61 @@ class DatabaseManager:
         Returns:
             List of column name strings, or empty list if table not found
         """
+        return self.get_tables_columns([(schema, table)]).get((schema, table), [])
+
+    def get_tables_columns(self, tables: List[Tuple[str, str]]) -> Dict[Tuple[str, str], list]:
+        """
+        Get real column names for several tables in one information_schema query.
+
+        Non-empty results are cached for COLUMNS_CACHE_TTL seconds; only
+        tables missing from the cache are fetched.
+
+        Args:
+            tables: List of (schema, table) pairs
+
+        Returns:
+            Dict mapping (schema, table) -> list of column names; tables not found are omitted
+        """
+        result = {}
+        missing = []
+        now = time.monotonic()
+        for key in dict.fromkeys(tables):
+            cached = self._columns_cache.get(key)
+            if cached and cached[0] > now:
+                result[key] = list(cached[1])
+            else:
+                missing.append(key)
+        if not missing:
+            return result
+
         sql = """
-            SELECT column_name
+            SELECT table_schema, table_name, column_name
             FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            ORDER BY ordinal_position
+            WHERE (table_schema, table_name) IN %s
+            ORDER BY table_schema, table_name, ordinal_position
         """
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(sql, (schema, table))
+                    cur.execute(sql, (tuple(missing),))
                     rows = cur.fetchall()
-                    return [row[0] for row in rows]
         except Exception as e:
             logger.error("Failed to get table columns: %s", str(e))
-            return []
+            return result
+
+        fetched = {}
+        for schema_name, table_name, column_name in rows:
+            fetched.setdefault((schema_name, table_name), []).append(column_name)
+        # Don't cache misses: the table may be created shortly after
+        expires_at = time.monotonic() + self.COLUMNS_CACHE_TTL
+        for key, columns in fetched.items():
+            self._columns_cache[key] = (expires_at, tuple(columns))
+        result.update(fetched)
+        return result
+
+    def clear_columns_cache(self):
+        """Drop cached column lists, e.g. after a schema migration."""
+        self._columns_cache.clear()
 
     def log_bot_user(self, user_info: dict):
         """
@@ -375,21 +554,24 @@ class DatabaseManager:
             logger.error("Failed to get recent interactions: %s", str(e))
             return []
 
-    def find_similar_cached_query(self, user_message: str, limit: int = 3) -> list:
+    def find_similar_cached_query(self, user_message: str, limit: int = 3, fresh_since: date = None) -> list:
         """
         Find similar successful queries using PostgreSQL full-text search on bot_query_patterns.
 
         Args:
             user_message: Current user query
             limit: Max number of similar queries to return
+            fresh_since: Patterns saved on or after this day are flagged as fresh
+                         (default: today — generated SQL may hardcode today's dates)
 
         Returns:
-            List of dicts with user_message and sql_query from past successes
+            List of dicts with user_message, sql_query and is_fresh from past successes
         """
         sql = """
             SELECT question_text, sql_query, row_count,
                    ts_rank(to_tsvector('russian', question_text),
-                           plainto_tsquery('russian', %s)) AS rank
+                           plainto_tsquery('russian', %s)) AS rank,
+                   created_at >= %s AS is_fresh
             FROM analytics.bot_query_patterns
             WHERE was_successful = true
               AND user_feedback IS DISTINCT FROM 'negative'
@@ -400,10 +582,13 @@ class DatabaseManager:
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(sql, (user_message, user_message, limit))
+                    cur.execute(sql, (user_message, fresh_since or date.today(), user_message, limit))
                     rows = cur.fetchall()
 
-            return [{"user_message": row[0], "sql_query": row[1]} for row in rows]
+            return [
+                {"user_message": row[0], "sql_query": row[1], "is_fresh": bool(row[4])}
+                for row in rows
+            ]
 
         except Exception as e:
             logger.error("Failed to find cached queries: %s", str(e))
@@ -1,25 +1,38 @@
 """
 Schema documentation loader from YAML files.
 """
+import hashlib
+import pickle
 import yaml
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# libyaml-backed loader is several times faster; fall back when PyYAML was built without it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _parse_yaml(data: bytes) -> Any:
+    """Parse one YAML document (UTF-8 bytes) with the fastest available safe loader."""
+    return yaml.load(data, Loader=_YAML_LOADER)
+
 
 class SchemaLoader:
     """Loads and manages database schema documentation from YAML files."""
 
-    def __init__(self, docs_path: Path):
+    def __init__(self, docs_path: Path, cache_path: Optional[Path] = None):
         """
         Initialize schema loader.
 
         Args:
             docs_path: Path to the docs directory containing YAML files
+            cache_path: Optional pickled snapshot of the parsed docs; reused on startup
+                        while the YAML files are unchanged
         """
         self.docs_path = Path(docs_path)
+        self.cache_path = Path(cache_path) if cache_path else None
         self.schema = {
             "tables": {},
             "semantic": {},
@@ -36,6 +49,10 @@ class SchemaLoader:
         """
         logger.info("Loading schema documentation from %s", self.docs_path)
 
+        signature = self.get_signature() if self.cache_path else None
+        if signature and self._load_snapshot(signature):
+            return self.schema
+
         try:
             self._load_tables()
             self._load_semantic()
@@ -48,12 +65,67 @@ class SchemaLoader:
                 len(self.schema["examples"])
             )
 
+            if signature:
+                self._save_snapshot(signature)
+
             return self.schema
 
         except Exception as e:
             logger.error("Failed to load schema: %s", str(e))
             raise
 
+    def _load_snapshot(self, signature: str) -> bool:
+        """
+        Load parsed docs from the pickled snapshot if it matches the YAML files.
+
+        Args:
+            signature: Current get_signature() of the docs
+
+        Returns:
+            True if the snapshot was fresh and loaded into self.schema
+        """
+        try:
+            snapshot = pickle.loads(self.cache_path.read_bytes())
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("Ignoring unreadable schema snapshot %s: %s", self.cache_path, str(e))
+            return False
+
+        if snapshot.get("signature") != signature:
+            logger.info("Schema snapshot is stale, reloading YAML docs")
+            return False
+
+        self.schema = snapshot["schema"]
+        logger.info(
+            "Schema loaded from snapshot: %d tables, %d examples",
+            len(self.schema["tables"]),
+            len(self.schema["examples"])
+        )
+        return True
+
+    def _save_snapshot(self, signature: str):
+        """
+        Write parsed docs to the pickled snapshot for the next startup.
+
+        Pickle keeps YAML values exactly as parsed (dates, non-string keys),
+        so a snapshot load is indistinguishable from a fresh YAML load.
+
+        Args:
+            signature: get_signature() of the docs the schema was loaded from
+        """
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            tmp_path.write_bytes(pickle.dumps(
+                {"signature": signature, "schema": self.schema},
+                protocol=pickle.HIGHEST_PROTOCOL
+            ))
+            tmp_path.replace(self.cache_path)
+            logger.debug("Saved schema snapshot to %s", self.cache_path)
+        except Exception as e:
+            logger.warning("Failed to save schema snapshot %s: %s", self.cache_path, str(e))
+
     def _load_tables(self):
         """Load table definitions from docs/tables/*.yml"""
         tables_path = self.docs_path / "tables"
@@ -64,11 +136,10 @@ class SchemaLoader:
 
         for table_file in tables_path.glob("*.yml"):
             try:
-                with open(table_file, encoding='utf-8') as f:
-                    table_data = yaml.safe_load(f)
-                    if table_data and "table" in table_data:
-                        self.schema["tables"][table_data["table"]] = table_data
-                        logger.debug("Loaded table: %s", table_data["table"])
+                table_data = _parse_yaml(table_file.read_bytes())
+                if table_data and "table" in table_data:
+                    self.schema["tables"][table_data["table"]] = table_data
+                    logger.debug("Loaded table: %s", table_data["table"])
             except Exception as e:
                 logger.error("Error loading table file %s: %s", table_file, str(e))
 
@@ -81,9 +152,8 @@ class SchemaLoader:
             return
 
         try:
-            with open(semantic_file, encoding='utf-8') as f:
-                self.schema["semantic"] = yaml.safe_load(f) or {}
-                logger.debug("Loaded semantic relationships")
+            self.schema["semantic"] = _parse_yaml(semantic_file.read_bytes()) or {}
+            logger.debug("Loaded semantic relationships")
         except Exception as e:
             logger.error("Error loading semantic file: %s", str(e))
 
@@ -96,9 +166,8 @@ class SchemaLoader:
             return
 
         try:
-            with open(glossary_file, encoding='utf-8') as f:
-                self.schema["glossary"] = yaml.safe_load(f) or {}
-                logger.debug("Loaded glossary")
+            self.schema["glossary"] = _parse_yaml(glossary_file.read_bytes()) or {}
+            logger.debug("Loaded glossary")
         except Exception as e:
             logger.error("Error loading glossary file: %s", str(e))
 
@@ -112,14 +181,28 @@ class SchemaLoader:
 
         for example_file in examples_path.glob("*.yml"):
             try:
-                with open(example_file, encoding='utf-8') as f:
-                    example_data = yaml.safe_load(f)
-                    if example_data:
-                        self.schema["examples"].append(example_data)
-                        logger.debug("Loaded example: %s", example_file.name)
+                example_data = _parse_yaml(example_file.read_bytes())
+                if example_data:
+                    self.schema["examples"].append(example_data)
+                    logger.debug("Loaded example: %s", example_file.name)
             except Exception as e:
                 logger.error("Error loading example file %s: %s", example_file, str(e))
 
+    def get_signature(self) -> str:
+        """
+        Get a digest of the documentation files (paths, sizes, mtimes).
+
+        Returns:
+            Hex digest that changes whenever any YAML doc is added, removed or edited
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for path in sorted(self.docs_path.rglob("*.yml")):
+            stat = path.stat()
+            digest.update(
+                f"{path.relative_to(self.docs_path)}\x00{stat.st_size}\x00{stat.st_mtime_ns}\n".encode("utf-8")
+            )
+        return digest.hexdigest()
+
     def get_table_names(self) -> List[str]:
         """Get list of all available table names."""
         return list(self.schema["tables"].keys())
@@ -0,0 +1,186 @@
+"""
+Lightweight semantic similarity for natural-language questions.
+
+Questions are embedded as L2-normalized bags of character n-grams, which is
+robust to Russian word endings and small rephrasings without pulling in a
+model runtime.
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional
+
+_NON_WORD_RE = re.compile(r'[^\w]+')
+# Russian inflection endings stripped to get a word stem
+_INFLECTION_CHARS = "аяоеыиуюьй"
+# Politeness and request fillers that don't change which SQL is needed
+_FILLER_WORDS = frozenset({
+    "пожалуйста", "покажи", "покажите", "выведи", "выведите", "дай", "дайте",
+    "скажи", "скажите", "мне", "нам", "please", "show", "me",
+})
+
+
+@lru_cache(maxsize=1024)
+def embed_text(text: str, n: int = 3) -> Dict[str, float]:
+    """
+    Embed text as a sparse vector of character n-grams.
+
+    Results are memoized per raw string, so callers must not mutate them.
+
+    Args:
+        text: Natural language text
+        n: N-gram length
+
+    Returns:
+        Dict mapping n-gram -> weight, L2-normalized (empty for blank text)
+    """
+    normalized = _NON_WORD_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+    if not normalized:
+        return {}
+
+    padded = f" {normalized} "
+    counts: Dict[str, int] = {}
+    for i in range(len(padded) - n + 1):
+        gram = padded[i:i + n]
+        counts[gram] = counts.get(gram, 0) + 1
+
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    return {gram: c / norm for gram, c in counts.items()}
+
+
+def cosine_similarity(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """
+    Cosine similarity of two vectors produced by embed_text().
+
+    Args:
+        a: First vector
+        b: Second vector
+
+    Returns:
+        Similarity in [0, 1]
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+def word_stems(text: str) -> FrozenSet[str]:
+    """
+    Reduce text to the set of its content word stems.
+
+    Character n-grams can't tell "в прошлом месяце" from "в этом месяце",
+    "за январь" from "за июнь" or "по возрастанию" from "по убыванию", yet
+    the SQL differs. Two questions asking the same thing in a different word
+    order or word form share the same stems, so callers should require equal
+    stem sets on top of the similarity. Every word counts, numbers and
+    negations included; only request fillers ("покажи", "пожалуйста") are dropped.
+
+    Args:
+        text: Natural language text
+
+    Returns:
+        Frozen set of lowercased word stems
+    """
+    stems = set()
+    for word in _NON_WORD_RE.split(text.lower().replace("ё", "е")):
+        if not word or word in _FILLER_WORDS:
+            continue
+        stem = word.rstrip(_INFLECTION_CHARS) if len(word) >= 4 else word
+        stems.add(stem if len(stem) >= 3 else word)
+    return frozenset(stems)
+
+
+class SemanticSQLCache:
+    """
+    In-process cache of generated SQL, looked up by question similarity.
+
+    Entries are namespaced by a key that must change whenever the answer for
+    the same question could change (schema prompt hash, current date, previous
+    SQL of a follow-up), expire after a TTL and are evicted oldest-first.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, maxsize: int = 256):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            ttl: Seconds an entry stays valid
+            maxsize: Max number of entries kept
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # (namespace, normalized question) -> (expires_at, embedding, guard tokens, sql)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def _guard_tokens(text: str) -> tuple:
+        """Tokens that must match exactly for a fuzzy hit: the content word stems."""
+        return word_stems(text)
+
+    def get(self, question: str, namespace: str) -> Optional[str]:
+        """
+        Find SQL generated for a (nearly) identical question.
+
+        Args:
+            question: Natural language question
+            namespace: Cache namespace (see class docstring)
+
+        Returns:
+            Cached SQL string, or None on miss
+        """
+        normalized = self._normalize(question)
+        now = time.monotonic()
+        with self._lock:
+            exact = self._entries.get((namespace, normalized))
+            if exact and exact[0] > now:
+                return exact[3]
+
+            vec = embed_text(normalized)
+            guard = self._guard_tokens(normalized)
+            best_score, best_sql = 0.0, None
+            for (entry_ns, _), (expires_at, entry_vec, entry_guard, sql) in self._entries.items():
+                if entry_ns != namespace or expires_at <= now or entry_guard != guard:
+                    continue
+                score = cosine_similarity(vec, entry_vec)
+                if score > best_score:
+                    best_score, best_sql = score, sql
+        return best_sql if best_score >= self.threshold else None
+
+    def put(self, question: str, namespace: str, sql: str):
+        """
+        Remember the SQL generated for a question.
+
+        Args:
+            question: Natural language question
+            namespace: Cache namespace (see class docstring)
+            sql: Generated SQL
+        """
+        normalized = self._normalize(question)
+        key = (namespace, normalized)
+        entry = (time.monotonic() + self.ttl, embed_text(normalized), self._guard_tokens(normalized), sql)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard_sql(self, sql: str):
+        """
+        Drop every entry that produced the given SQL (e.g. after it failed).
+
+        Args:
+            sql: SQL string to forget
+        """
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[3] == sql]:
+                del self._entries[key]
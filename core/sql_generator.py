@@ -1,47 +1,388 @@
 
 """
-SQL query generation using OpenAI and schema documentation.
+SQL query generation using Anthropic Claude and schema documentation.
 """
+import asyncio
+import hashlib
 import re
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Final, List, Optional, Tuple, Union
+import orjson
 from anthropic import Anthropic
 from utils.logger import setup_logger
+from .semantic_cache import embed_text, cosine_similarity, word_stems, SemanticSQLCache
 
 logger = setup_logger(__name__)
 
+# Static rules that open every system prompt
+_PROMPT_HEADER: Final[str] = """Ты — SELECT SQL-бот для базы данных Hero's Journey.
+
+        ПРАВИЛА:
+        1. Генерируй ТОЛЬКО валидный SELECT SQL без комментариев
+        2. Используй ТОЛЬКО документированные таблицы и поля
+        3. Учитывай timezone Asia/Almaty для всех дат
+        4. Для связи таблиц используй указанные relationships
+        5. Колонка "user" обязательно должна использвться с двойными кавычками "user"
+        6. Запрещены: DROP, DELETE, UPDATE, INSERT, ALTER, TRUNCATE
+        7. Выводи ТОЛЬКО сырой SQL — без markdown, без ``` и без пояснений
+
+        ⚠️ КРИТИЧЕСКИ ВАЖНО — НИКОГДА НЕ ВОЗВРАЩАЙ ГОЛЫЕ ID:
+        - Если в результате есть FK-колонка (award, marathonevent, user, clan, event и т.д.) — ВСЕГДА делай JOIN чтобы получить человекочитаемое название
+        - Примеры:
+          ❌ SELECT award FROM useraward → возвращает "611208d4b8fd8d00172c81f0" — ЗАПРЕЩЕНО
+          ✅ SELECT ua.*, aw.name as award_name FROM ods_core.useraward ua LEFT JOIN ods_core.award aw ON ua.award = aw.id
+          ❌ SELECT marathonevent FROM useraward → возвращает голый ID
+          ✅ SELECT ua.*, me.name as marathon_name FROM ods_core.useraward ua LEFT JOIN ods_core.marathonevent me ON ua.marathonevent = me.id
+        - Если JOIN невозможен (таблица неизвестна), хотя бы включи name/title/description из основной таблицы
+        - Пользователь должен видеть НАЗВАНИЯ, не технические ID
+
+        ВАЖНО ДЛЯ НАЗВАНИЙ ПРОГРАММ:
+        - Пользователи могут писать названия программ на русском или в неформальном виде
+        - Ты ДОЛЖЕН конвертировать их в точные значения из allowed_values
+        - Используй блок НАЗВАНИЯ ИЗ ВОПРОСА (если он есть) для правильного маппинга
+        - Римские цифры (I, II, III, IV) НЕ заменяй на арабские (1, 2, 3, 4) в SQL!
+
+        ПРАВИЛА ВЫБОРА СХЕМЫ:
+        - ods_core — основная схема для общих вопросов (пользователи, чекины, марафоны, платежи и т.д.)
+        - ris — только для вопросов про ретеншн (retention)
+        - stage — запасная схема, если в ods_core нет нужных данных
+        ⚠️ ЗАПРЕЩЕНО использовать olap_schema и raw!
+
+        ЧАСТЫЕ ОШИБКИ (НЕ ДЕЛАЙ):
+        ❌ Использовать поля из другой таблицы без JOIN
+        ❌ Выдумывать названия колонок
+        ❌ Использовать схему olap_schema или raw
+        ❌ Писать "Burn 1" вместо "Burn I"
+        ❌ Писать "Берн 1" вместо "Burn I"
+        ❌ Писать "Fit Body III" вместо "Fit body III"
+        ✅ Правильно: используй только задокументированные поля и точные названия из allowed_values
+
+        КРИТИЧЕСКИ ВАЖНО - ПРАВИЛА ЭКРАНИРОВАНИЯ PostgreSQL:
+        ⚠️ ОБЯЗАТЕЛЬНО используй двойные кавычки "" для зарезервированных слов PostgreSQL!
+
+        ВСЕГДА ЭКРАНИРУЙ ЭТИ ПОЛЯ:
+        - "user" - ВСЕГДА в кавычках (reserved word)
+        - "event" - ВСЕГДА в кавычках (reserved word)
+        - "group" - ВСЕГДА в кавычках (reserved word)
+        - "level" - ВСЕГДА в кавычках (reserved word)
+        - "status" - ВСЕГДА в кавычках (reserved word)
+        - "type" - ВСЕГДА в кавычках (reserved word)
+        - "comment" - ВСЕГДА в кавычках (reserved word)
+        - "name" - ВСЕГДА в кавычках (reserved word)
+        - "cost" - ВСЕГДА в кавычках (reserved word)
+        - "program" - ВСЕГДА в кавычках (reserved word)
+
+        ПРАВИЛА КАВЫЧЕК:
+        1. Двойные кавычки "" - для названий полей/таблиц (идентификаторов)
+        ✅ SELECT "user", "event" FROM booking
+        ❌ SELECT user, event FROM booking
+
+        2. Одинарные кавычки '' - для строковых значений
+        ✅ WHERE marathon_name = 'Burn I'
+        ❌ WHERE marathon_name = "Burn I"
+
+        3. Удваивай апостроф внутри строк
+        ✅ WHERE marathon_name = 'Hero''s Week'
+        ❌ WHERE marathon_name = 'Hero's Week'
+    """
+
+# Built system prompts keyed by schema signature, shared by all SQLGenerator instances
+_SYSTEM_PROMPT_CACHE: Dict[str, str] = {}
+_SYSTEM_PROMPT_CACHE_SIZE = 4
+
+# Past successful questions at least this similar are answered from cache, skipping the LLM
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# Business terms, column descriptions and examples retrieved per question,
+# and the minimum similarity to include one
+BUSINESS_TERMS_TOP_K = 5
+COLUMNS_TOP_K = 8
+EXAMPLES_TOP_K = 3
+RETRIEVAL_MIN_SCORE = 0.1
+
+# User message for error-correction retries, filled via format_map()
+_RETRY_TEMPLATE: Final[str] = (
+    "Запрос пользователя: {user_prompt}\n\n"
+    "Предыдущий SQL:\n{failed_sql}\n\n"
+    "Результат:\n{error_message}\n"
+    "{tried_block}{real_columns_info}\n"
+    "{instruction}"
+)
+# Retry instruction when the previous SQL ran but returned no rows
+_RETRY_EMPTY_INSTRUCTION: Final[str] = (
+    "Запрос вернул 0 строк — данных в этой таблице нет.\n"
+    "ОБЯЗАТЕЛЬНО смени таблицу или схему. Посмотри в других схемах: ods_core, stage, ris.\n"
+    "Попробуй найти похожие данные в другой таблице из списка доступных таблиц выше.\n"
+    "Верни ТОЛЬКО новый SQL без объяснений."
+)
+# Retry instruction when the previous SQL failed with a database error
+_RETRY_ERROR_INSTRUCTION: Final[str] = (
+    "Исправь SQL запрос, учитывая ошибку. Используй ТОЛЬКО реальные колонки из документации схемы.\n"
+    "Если ошибка связана с несуществующей колонкой — удали её или замени правильной.\n"
+    "Верни ТОЛЬКО исправленный SQL без объяснений."
+)
+
+# SQL inside a markdown code block (```sql ... ```)
+_SQL_BLOCK_RE = re.compile(r'```sql\s*\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+# Opening fence of a markdown SQL block, searched incrementally while streaming
+_SQL_FENCE_RE = re.compile(r'```sql', re.IGNORECASE)
+# Response that starts straight with a query (no fence, no prose)
+_SQL_PREFIX_RE = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+# Schema-qualified table after FROM (e.g. "FROM ods_core.user"); also used by the analytical agent
+_FROM_TABLE_RE = re.compile(r'FROM\s+([\w]+)\.([\w]+)', re.IGNORECASE)
+# Every schema-qualified table after FROM or JOIN
+_TABLE_REF_RE = re.compile(r'(?:FROM|JOIN)\s+([\w]+)\.([\w]+)', re.IGNORECASE)
+# Schemas the bot may query, in order of preference
+_SCHEMA_ORDER: Final[Tuple[str, ...]] = ("ods_core", "stage", "ris")
+
+# Error text signalling that the previous SQL ran fine but returned no rows
+_EMPTY_RESULT_RE = re.compile(r'0 строк|вернул 0', re.IGNORECASE)
+# Prompts opening with these verbs usually start a new, self-contained request
+_NEW_TOPIC_RE = re.compile(r'^\s*(новый|покажи|выведи|сколько|список)\b', re.IGNORECASE)
+# Wording that usually needs joins, exclusions, grouping or comparisons — not for the fast model
+_COMPLEX_PROMPT_RE = re.compile(
+    r'\b(которы\w*|кроме|без|сравни\w*|динамик\w*|в\s+разрезе|по\s+кажд\w*|'
+    r'групп\w*|ретеншн\w*|retention|когорт\w*|конверси\w*|выгруз\w*|таблиц\w*)\b',
+    re.IGNORECASE
+)
+# Anything that separates words, for whole-word name matching
+_NON_WORD_RE = re.compile(r'[^\w]+')
+# Endings dropped from name words before prefix matching (Russian case endings)
+_INFLECTION_CHARS: Final[str] = "аяоеыиуюьй"
+# Anaphora that ties a prompt to the previous turn ("а у этих?", "а ещё за март")
+_ANAPHORA_RE = re.compile(r'\b(этот|эта|это|эти|этих|тот|та|те|тех|они|их|них|ним|ними|же|ещё|еще)\b', re.IGNORECASE)
+
+
+def _name_stems(name: str) -> Tuple[Tuple[str, bool], ...]:
+    """
+    Split a program/club name into (stem, is_prefix) pairs for matching inflected prompts.
+
+    Russian names change their ending in a question ("в Променаде", "в Вилле",
+    "Нурлы Орды"), so words of 4+ characters drop trailing vowels and match as
+    a prefix of a prompt word; shorter ones ("НО", "ЕС", "1") must match whole.
+    """
+    stems = []
+    for word in _NON_WORD_RE.sub(" ", name.lower().replace("ё", "е")).split():
+        stem = word.rstrip(_INFLECTION_CHARS) if len(word) >= 4 else word
+        if len(stem) >= 3 and len(word) >= 4:
+            stems.append((stem, True))
+        else:
+            stems.append((word, False))
+    return tuple(stems)
+
+
+def _name_in_words(stems: Tuple[Tuple[str, bool], ...], words: List[str]) -> bool:
+    """Check whether the name's words appear consecutively among the prompt words."""
+    for i in range(len(words) - len(stems) + 1):
+        if all(words[i + j].startswith(stem) if is_prefix else words[i + j] == stem
+               for j, (stem, is_prefix) in enumerate(stems)):
+            return True
+    return False
+
 
 class SQLGenerator:
-    """Generates SQL queries from natural language using OpenAI."""
+    """Generates SQL queries from natural language using Anthropic Claude."""
+
+    # Retries on the cheap retry model before escalating to the main model
+    RETRY_MODEL_ATTEMPTS = 2
+
+    # Prompts up to this length without complexity hints go to fast_model
+    SIMPLE_PROMPT_MAX_CHARS = 80
 
-    def __init__(self, api_key: str, model: str = "claude-sonnet-4-5-20250929"):
+    def __init__(self, api_key: str, model: str = "claude-sonnet-4-5-20250929",
+                 retry_model: str = "claude-haiku-4-5", fast_model: str = None):
         """
         Initialize SQL generator.
 
         Args:
             api_key: Anthropic API key
             model: Anthropic model to use
+            retry_model: Cheaper model for error-correction retries
+            fast_model: Cheaper model for short, simple questions (None = always use model)
         """
         self.client = Anthropic(api_key=api_key)
         self.model = model
+        self.retry_model = retry_model
+        self.fast_model = fast_model
         self.system_prompt = ""
+        self.system_prompt_hash = ""  # sha256 of system_prompt, changes only when the schema does
         self.db_manager = None  # Set after init if caching needed
+        self._base_system_prompt = ""  # system prompt built from docs, without live tables
         self._live_tables = {}  # schema -> [table, ...] from DB
-
-    def set_schema(self, schema_docs: Dict[str, Any]):
+        self._live_tables_block = ""  # pre-formatted live tables section of system prompt
+        # Docs retrieved per question instead of living in the static prompt
+        self._business_terms = []  # (embedding, formatted text) per glossary term
+        self._column_docs = []  # (embedding, formatted text) per column without synonyms
+        self._examples = []  # (embedding, formatted text) per example query
+        self._name_mappings = []  # (stems of each name, formatted line) per program/club
+        self._inflight: Dict[str, Future] = {}  # request key -> pending generation or LLM call
+        self._inflight_lock = threading.Lock()
+        self._prompt_in_use = False  # True once system_prompt was sent (and cached) by the API
+        self._sql_cache = SemanticSQLCache()  # SQL generated by this process, by question similarity
+
+    def set_schema(self, schema_docs: Dict[str, Any], schema_key: str = None):
         """
         Set schema documentation and generate system prompt.
 
         Args:
             schema_docs: Schema documentation loaded from YAML files
+            schema_key: Optional signature of the docs (SchemaLoader.get_signature());
+                        prompts built for the same key are reused instead of rebuilt
         """
-        self.system_prompt = self._generate_system_prompt(schema_docs)
+        prompt = _SYSTEM_PROMPT_CACHE.get(schema_key) if schema_key else None
+        if prompt is None:
+            prompt = self._generate_system_prompt(schema_docs)
+            if schema_key:
+                if len(_SYSTEM_PROMPT_CACHE) >= _SYSTEM_PROMPT_CACHE_SIZE:
+                    _SYSTEM_PROMPT_CACHE.pop(next(iter(_SYSTEM_PROMPT_CACHE)))
+                _SYSTEM_PROMPT_CACHE[schema_key] = prompt
+        else:
+            logger.info("Reusing system prompt built for schema %s", schema_key)
+        self._base_system_prompt = prompt
+        self._freeze_system_prompt(prompt + self._live_tables_block)
+        (self._business_terms, self._column_docs,
+         self._examples, self._name_mappings) = self._index_schema_docs(schema_docs)
         logger.info("System prompt generated with %d characters", len(self.system_prompt))
 
+    def _freeze_system_prompt(self, prompt: str):
+        """
+        Install the static system prompt and its hash.
+
+        The prompt is the cached prefix of every request, so it must stay
+        byte-identical between calls; all per-request text goes into later blocks.
+
+        Args:
+            prompt: Full static system prompt
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if prompt_hash == self.system_prompt_hash:
+            return
+        if self._prompt_in_use:
+            logger.warning("System prompt changed after first use — Anthropic prompt cache will be rebuilt")
+        self.system_prompt = prompt
+        self.system_prompt_hash = prompt_hash
+        logger.info("System prompt frozen: %d chars, hash %s", len(prompt), prompt_hash[:12])
+
+    @staticmethod
+    def _index_schema_docs(schema_docs: Dict[str, Any]) -> Tuple[list, list, list, list]:
+        """
+        Pre-format the docs that are retrieved per question instead of living in the static prompt.
+
+        Args:
+            schema_docs: Schema documentation loaded from YAML files
+
+        Returns:
+            Tuple of (business terms, column descriptions, examples, name mappings):
+            terms, columns and examples as (embedding, formatted text) tuples,
+            mappings as (name stems, formatted line) tuples
+        """
+        glossary = schema_docs["glossary"]
+
+        terms = []
+        for term in glossary.get("business_terms", ()):
+            canonical = term.get("canonical", "")
+            synonyms = term.get("synonyms_ru", ())
+            lines = [f"{canonical}: {term.get('definition', '')}", f"Синонимы: {', '.join(synonyms)}"]
+            if "sql_logic" in term:
+                lines.append(f"SQL логика: {term['sql_logic']}")
+            searchable = " ".join([canonical, *synonyms, term.get("entity", "")])
+            terms.append((embed_text(searchable), "\n".join(lines)))
+
+        # Columns with synonyms keep their description in the static DDL; the rest
+        # ("lla" = "Левая рука - мышечная масса") are only findable through this index
+        columns = []
+        for table_name, table_data in schema_docs["tables"].items():
+            for col in table_data.get("columns", ()):
+                description = col.get("description", "")
+                if col.get("synonyms_ru") is not None or not description:
+                    continue
+                columns.append((
+                    embed_text(f"{col['name']} {description}"),
+                    f"{table_name}.{col['name']} ({col['type']}): {description}"
+                ))
+
+        examples = []
+        for example in schema_docs["examples"]:
+            question = example.get("question_ru", "")
+            text = f"Вопрос: {question}"
+            if "sql" in example and "statement" in example["sql"]:
+                text += f"\nSQL:\n{example['sql']['statement']}"
+            examples.append((embed_text(question), text))
+
+        mappings = []
+        programs = glossary.get("program_name_mappings", ())
+        clubs = glossary.get("club_name_mappings", {}).get("mappings", ())
+        for item in (*programs, *clubs):
+            canonical = item.get("canonical", "")
+            synonyms = item.get("synonyms", ())
+            names = tuple(_name_stems(name) for name in [canonical, *synonyms] if name.strip())
+            mappings.append((names, f"'{canonical}' ← {', '.join(synonyms)}"))
+
+        return terms, columns, examples, mappings
+
+    def _retrieve_schema_context(self, user_prompt: str) -> List[str]:
+        """
+        Pick the business terms, column descriptions, name mappings and examples relevant to the question.
+
+        Args:
+            user_prompt: Natural language question
+
+        Returns:
+            List of formatted blocks (empty ones omitted)
+        """
+        blocks = []
+        prompt_vec = embed_text(user_prompt)
+
+        terms = self._top_matches(prompt_vec, self._business_terms, BUSINESS_TERMS_TOP_K)
+        if terms:
+            blocks.append("=== БИЗНЕС-ТЕРМИНЫ ===\n" + "\n\n".join(terms))
+
+        columns = self._top_matches(prompt_vec, self._column_docs, COLUMNS_TOP_K)
+        if columns:
+            blocks.append("=== ОПИСАНИЯ КОЛОНОК ===\n" + "\n".join(columns))
+
+        # Names match by word stems, so inflected forms ("в Вилле") hit while short
+        # synonyms ("НО") still only match as whole words
+        words = _NON_WORD_RE.sub(" ", user_prompt.lower().replace("ё", "е")).split()
+        mappings = [line for names, line in self._name_mappings if any(_name_in_words(n, words) for n in names)]
+        if mappings:
+            blocks.append(
+                "=== НАЗВАНИЯ ИЗ ВОПРОСА ===\n"
+                "В SQL используй ТОЧНО каноническое значение (слева от ←):\n" + "\n".join(mappings)
+            )
+
+        examples = self._top_matches(prompt_vec, self._examples, EXAMPLES_TOP_K)
+        if examples:
+            blocks.append("=== ПРИМЕРЫ ЗАПРОСОВ ===\n" + "\n\n".join(examples))
+
+        return blocks
+
+    @staticmethod
+    def _top_matches(prompt_vec: Dict[str, float], index: list, top_k: int) -> List[str]:
+        """
+        Rank (embedding, text) entries by similarity to the prompt.
+
+        Args:
+            prompt_vec: embed_text() of the question
+            index: List of (embedding, text) tuples
+            top_k: Max number of texts to return
+
+        Returns:
+            Texts of the top_k entries scoring at least RETRIEVAL_MIN_SCORE, best first
+        """
+        scored = sorted(
+            ((cosine_similarity(prompt_vec, vec), text) for vec, text in index),
+            key=lambda item: item[0], reverse=True
+        )
+        return [text for score, text in scored[:top_k] if score >= RETRIEVAL_MIN_SCORE]
+
     def load_live_tables(self):
         """
         Fetch all tables from all schemas via db_manager and append to system prompt.
         Must be called after set_schema() and after db_manager is set.
+        Calling it again only rebuilds the section when the table list changed.
         """
         if not self.db_manager:
             logger.warning("db_manager not set — skipping live table load")
@@ -50,22 +391,28 @@ class SQLGenerator:
         if not tables:
             logger.warning("No live tables fetched from DB")
             return
+        if tables == self._live_tables and self._live_tables_block:
+            logger.info("Live tables unchanged — keeping existing system prompt section")
+            return
         self._live_tables = tables
 
         # Append live table section to system prompt
-        section = "\n\n=== ВСЕ ДОСТУПНЫЕ ТАБЛИЦЫ В БД (из information_schema) ===\n"
-        section += "Используй эти таблицы для поиска данных.\n"
-        section += "⚠️ ЗАПРЕЩЕНО использовать схемы olap_schema и raw!\n"
-        section += "ПРАВИЛА ВЫБОРА СХЕМЫ:\n"
-        section += "- ods_core — основная схема для общих вопросов (пользователи, чекины, марафоны, платежи и т.д.)\n"
-        section += "- ris — только для вопросов про ретеншн (retention)\n"
-        section += "- stage — запасная схема, если в ods_core нет нужных данных\n\n"
-        for schema_name in ("ods_core", "stage", "ris"):
+        parts = [
+            "\n\n=== ВСЕ ДОСТУПНЫЕ ТАБЛИЦЫ В БД (из information_schema) ===\n",
+            "Используй эти таблицы для поиска данных.\n",
+            "⚠️ ЗАПРЕЩЕНО использовать схемы olap_schema и raw!\n",
+            "ПРАВИЛА ВЫБОРА СХЕМЫ:\n",
+            "- ods_core — основная схема для общих вопросов (пользователи, чекины, марафоны, платежи и т.д.)\n",
+            "- ris — только для вопросов про ретеншн (retention)\n",
+            "- stage — запасная схема, если в ods_core нет нужных данных\n\n",
+        ]
+        for schema_name in _SCHEMA_ORDER:
             if schema_name in tables:
                 tlist = ", ".join(tables[schema_name])
-                section += f"Схема '{schema_name}' ({len(tables[schema_name])} таблиц):\n{tlist}\n\n"
+                parts.append(f"Схема '{schema_name}' ({len(tables[schema_name])} таблиц):\n{tlist}\n\n")
+        self._live_tables_block = "".join(parts)
 
-        self.system_prompt += section
+        self._freeze_system_prompt(self._base_system_prompt + self._live_tables_block)
         logger.info(
             "Appended live tables to system prompt: %d schemas, total prompt length %d chars",
             len(tables), len(self.system_prompt)
@@ -89,7 +436,7 @@ class SQLGenerator:
             return ""
         # Build flat table list for Claude to pick from
         all_tables_flat = []
-        for schema_name in ("ods_core", "stage", "ris"):
+        for schema_name in _SCHEMA_ORDER:
             for tbl in self._live_tables.get(schema_name, []):
                 all_tables_flat.append(f"{schema_name}.{tbl}")
 
@@ -108,14 +455,11 @@ class SQLGenerator:
 Ответь ТОЛЬКО списком таблиц в формате schema.table, по одной на строку. Никаких объяснений."""
 
         try:
-            pick_response = self.client.messages.create(
-                model=self.model,
-                system="Ты эксперт по базам данных. Отвечай только списком таблиц.",
-                messages=[{"role": "user", "content": pick_prompt}],
-                temperature=0.0,
+            picked_raw = self._complete(
+                "Ты эксперт по базам данных. Отвечай только списком таблиц.",
+                pick_prompt,
                 max_tokens=200
             )
-            picked_raw = pick_response.content[0].text.strip()
             logger.info("Claude picked tables for discovery:\n%s", picked_raw)
         except Exception as e:
             logger.error("Failed to pick tables for discovery: %s", e)
@@ -154,8 +498,10 @@ class SQLGenerator:
                 discovery_parts.append("Примеры строк:")
                 for row in sample["rows"]:
                     # Show truncated values to keep prompt size reasonable
-                    row_preview = {k: (str(v)[:80] if v is not None else "NULL") for k, v in row.items()}
-                    discovery_parts.append(f"  {row_preview}")
+                    row_preview = {k: ("NULL" if v is None else str(v)[:80]) for k, v in row.items()}
+                    discovery_parts.append(
+                        "  " + orjson.dumps(row_preview, option=orjson.OPT_NON_STR_KEYS).decode()
+                    )
             else:
                 discovery_parts.append("  (таблица пустая)")
             discovery_parts.append("")
@@ -191,42 +537,101 @@ class SQLGenerator:
 
         logger.info("Generating SQL for prompt: %s", user_prompt[:100])
 
+        if conversation_context and self._looks_like_new_topic(user_prompt):
+            logger.info("Prompt looks like a new topic — skipping conversation context")
+            conversation_context = None
+
+        # Generated SQL depends on the schema prompt, today's date and, for follow-ups, the previous SQL
+        cache_namespace = f"{self.system_prompt_hash}:{datetime.now().date()}"
+        if conversation_context:
+            cache_namespace += ":" + (conversation_context.get("previous_sql") or "")
+        cached_sql = self._sql_cache.get(user_prompt, cache_namespace)
+        if cached_sql:
+            logger.info("Local SQL cache hit for prompt: %s", user_prompt[:100])
+            return cached_sql
+
+        # Coalesce concurrent identical questions: discovery, DB lookups and LLM calls run once
+        key = "query:" + hashlib.sha256(
+            f"{' '.join(user_prompt.lower().split())}\x00{cache_namespace}".encode("utf-8")
+        ).hexdigest()
+        return self._single_flight(
+            key, lambda: self._generate_query_uncached(user_prompt, conversation_context, cache_namespace)
+        )
+
+    async def generate_query_async(self, user_prompt: str, conversation_context: dict = None) -> str:
+        """
+        Async variant of generate_query() for event-loop callers (the MCP server).
+
+        Generation blocks on the Anthropic API and the database, so it runs in a
+        worker thread; the loop keeps serving other calls meanwhile. Caching and
+        coalescing are shared with generate_query(), which is thread-safe.
+
+        Args:
+            user_prompt: Natural language question
+            conversation_context: Optional dict with previous conversation context
+
+        Returns:
+            Generated SQL query string
+        """
+        return await asyncio.to_thread(self.generate_query, user_prompt, conversation_context)
+
+    def forget_sql(self, sql: str):
+        """
+        Stop serving the given SQL from the local cache, e.g. after it failed to execute.
+
+        Args:
+            sql: SQL previously returned by generate_query()
+        """
+        self._sql_cache.discard_sql(sql)
+
+    def _generate_query_uncached(self, user_prompt: str, conversation_context: Optional[dict],
+                                 cache_namespace: str) -> str:
+        """Generate SQL without the local cache and coalescing. See generate_query()."""
         try:
+            cached = self.db_manager.find_similar_cached_query(user_prompt) if self.db_manager else []
+
+            # Semantic cache: a near-duplicate of a recent success needs no LLM round-trip
+            # (nor any prompt assembly); keep it locally so repeats skip the DB lookup too
+            if not conversation_context:
+                cached_sql = self._find_cached_sql(user_prompt, cached)
+                if cached_sql:
+                    self._sql_cache.put(user_prompt, cache_namespace, cached_sql)
+                    return cached_sql
+
             date_block = self._get_date_block()
             logger.info("Date block injected: %s", date_block[:80])
-            system_text = self.system_prompt + date_block
+            system_parts = [date_block]
 
+            # Conversation context changes every turn, so it goes into the user message,
+            # after all system blocks, keeping them cacheable across turns
+            user_content = user_prompt
             if conversation_context:
-                context_msg = self._build_context_message(conversation_context)
-                system_text += "\n\n" + context_msg
+                user_content = self._build_context_message(conversation_context) + "\n\n" + user_prompt
                 logger.info("Added conversation context to SQL generation")
 
+            system_parts.extend(self._retrieve_schema_context(user_prompt))
+
             # Phase 0: Data Discovery — sample relevant tables so Claude sees real column content
             discovery_block = self.discover_relevant_tables(user_prompt)
             if discovery_block:
-                system_text += "\n\n" + discovery_block
+                system_parts.append(discovery_block)
                 logger.info("Injected data discovery block into SQL prompt")
 
             # Inject cached successful queries as additional examples
-            if self.db_manager:
-                cached = self.db_manager.find_similar_cached_query(user_prompt)
-                if cached:
-                    cache_block = "\n=== ПОХОЖИЕ УСПЕШНЫЕ ЗАПРОСЫ ИЗ ИСТОРИИ ===\n"
-                    cache_block += "Эти запросы уже успешно выполнялись — используй их как образец:\n\n"
-                    for item in cached:
-                        cache_block += f"Вопрос: {item['user_message']}\nSQL:\n{item['sql_query']}\n\n"
-                    system_text += "\n\n" + cache_block
-                    logger.info("Injected %d cached queries into prompt", len(cached))
-
-            response = self.client.messages.create(
-                model=self.model,
-                system=system_text,
-                messages=[{"role": "user", "content": user_prompt}],
-                temperature=0.0,
-                max_tokens=2000
-            )
-
-            sql_output = response.content[0].text.strip()
+            if cached:
+                cache_parts = [
+                    "\n=== ПОХОЖИЕ УСПЕШНЫЕ ЗАПРОСЫ ИЗ ИСТОРИИ ===\n",
+                    "Эти запросы уже успешно выполнялись — используй их как образец:\n\n",
+                ]
+                for item in cached:
+                    cache_parts.append(f"Вопрос: {item['user_message']}\nSQL:\n{item['sql_query']}\n\n")
+                system_parts.append("".join(cache_parts))
+                logger.info("Injected %d cached queries into prompt", len(cached))
+
+            system_text = "\n\n".join(system_parts)
+            model = self.fast_model if self._is_simple_prompt(user_prompt, conversation_context) else self.model
+            logger.info("Generating SQL with model %s", model)
+            sql_output = self._complete(self._system_blocks(system_text), user_content, model=model)
 
             # Extract SQL from markdown code blocks if present
             sql_output = self._extract_sql_from_response(sql_output)
@@ -234,23 +639,60 @@ class SQLGenerator:
             logger.info("Generated SQL query successfully")
             logger.debug("SQL: %s", sql_output)
 
+            self._sql_cache.put(user_prompt, cache_namespace, sql_output)
             return sql_output
 
         except Exception as e:
             logger.error("Failed to generate SQL: %s", str(e))
             raise
 
+    @staticmethod
+    def _find_cached_sql(user_prompt: str, cached: list) -> Optional[str]:
+        """
+        Pick the SQL of a successful query asked today with (nearly) the same words.
+
+        Only patterns saved today qualify: the prompt makes the model write date
+        literals from today's date, so older SQL may answer "вчера" wrongly.
+
+        Args:
+            user_prompt: Natural language question
+            cached: Candidates from db_manager.find_similar_cached_query()
+
+        Returns:
+            Cached SQL string, or None if no fresh candidate is similar enough
+        """
+        if not cached:
+            return None
+
+        prompt_vec = embed_text(user_prompt)
+        prompt_stems = word_stems(user_prompt)
+        for item in cached:
+            # "на прошлой неделе" vs "на этой неделе" look alike to n-grams but need other SQL
+            if not item.get("is_fresh") or word_stems(item["user_message"]) != prompt_stems:
+                continue
+            score = cosine_similarity(prompt_vec, embed_text(item["user_message"]))
+            if score >= SEMANTIC_CACHE_THRESHOLD:
+                logger.info("Semantic cache hit (similarity %.3f): %s", score, item["user_message"][:100])
+                return item["sql_query"]
+
+        return None
+
     def generate_query_with_error(self, user_prompt: str, failed_sql: str, error_message: str,
-                                   conversation_context: dict = None, tried_tables: set = None) -> str:
+                                   conversation_context: dict = None, tried_tables: set = None,
+                                   attempt: int = 1) -> str:
         """
         Retry SQL generation with error feedback for self-correction.
 
+        The first RETRY_MODEL_ATTEMPTS retries use retry_model (small edits like a
+        column or schema fix); later ones escalate to the main model.
+
         Args:
             user_prompt: Original natural language question
             failed_sql: The SQL that failed
             error_message: The error from the database
             conversation_context: Optional conversation context
             tried_tables: Set of "schema.table" strings already tried (to avoid repeating)
+            attempt: 1-based retry number
 
         Returns:
             Corrected SQL query string
@@ -258,34 +700,39 @@ class SQLGenerator:
         if not self.system_prompt:
             raise ValueError("Schema not set. Call set_schema() first.")
 
-        logger.info("Retrying SQL generation with error feedback")
+        # The failed SQL must not be served from the local cache again
+        self.forget_sql(failed_sql)
+
+        model = self.retry_model if attempt <= self.RETRY_MODEL_ATTEMPTS else self.model
+        logger.info("Retrying SQL generation with error feedback (attempt %d, model %s)", attempt, model)
 
         try:
-            system_text = self.system_prompt + self._get_date_block()
-            if conversation_context:
-                context_msg = self._build_context_message(conversation_context)
-                system_text += "\n\n" + context_msg
+            system_text = self._get_date_block()
 
-            is_empty_result = "0 строк" in error_message or "вернул 0" in error_message.lower()
+            is_empty_result = bool(_EMPTY_RESULT_RE.search(error_message))
 
             # Extract schema.table from the failed SQL
             real_columns_info = ""
             failed_schema_table = None
             if self.db_manager and failed_sql:
-                from_match = re.search(r'FROM\s+([\w]+)\.([\w]+)', failed_sql, re.IGNORECASE)
+                from_match = _FROM_TABLE_RE.search(failed_sql)
                 if from_match:
-                    schema_name, table_name = from_match.group(1), from_match.group(2)
-                    failed_schema_table = f"{schema_name}.{table_name}"
-
-                    if not is_empty_result:
-                        # Real SQL error (column missing, syntax, etc.) — inject real columns to help fix
-                        real_cols = self.db_manager.get_table_columns(schema_name, table_name)
-                        if real_cols:
-                            real_columns_info = (
-                                f"\nРЕАЛЬНЫЕ КОЛОНКИ таблицы {schema_name}.{table_name}:\n"
-                                f"{', '.join(real_cols)}\nИСПОЛЬЗУЙ ТОЛЬКО ЭТИ КОЛОНКИ!\n"
+                    failed_schema_table = f"{from_match.group(1)}.{from_match.group(2)}"
+
+                if not is_empty_result:
+                    # Real SQL error (column missing, syntax, etc.) — inject real columns
+                    # of every referenced table to help fix, fetched in one query
+                    refs = [m.groups() for m in _TABLE_REF_RE.finditer(failed_sql)]
+                    real_cols = self.db_manager.get_tables_columns(refs) if refs else {}
+                    if real_cols:
+                        col_parts = []
+                        for (schema_name, table_name), cols in real_cols.items():
+                            col_parts.append(
+                                f"\nРЕАЛЬНЫЕ КОЛОНКИ таблицы {schema_name}.{table_name}:\n{', '.join(cols)}\n"
                             )
-                            logger.info("Fetched %d real columns for %s.%s", len(real_cols), schema_name, table_name)
+                        col_parts.append("ИСПОЛЬЗУЙ ТОЛЬКО ЭТИ КОЛОНКИ!\n")
+                        real_columns_info = "".join(col_parts)
+                        logger.info("Fetched real columns for %d tables", len(real_cols))
 
             # Build tried_tables block for the prompt
             tried_block = ""
@@ -300,39 +747,19 @@ class SQLGenerator:
                     f"✅ ОБЯЗАТЕЛЬНО используй ДРУГУЮ таблицу или ДРУГУЮ схему (ods_core, stage, ris).\n"
                 )
 
-            if is_empty_result:
-                instruction = (
-                    "Запрос вернул 0 строк — данных в этой таблице нет.\n"
-                    "ОБЯЗАТЕЛЬНО смени таблицу или схему. Посмотри в других схемах: ods_core, stage, ris.\n"
-                    "Попробуй найти похожие данные в другой таблице из списка доступных таблиц выше.\n"
-                    "Верни ТОЛЬКО новый SQL без объяснений."
-                )
-            else:
-                instruction = (
-                    "Исправь SQL запрос, учитывая ошибку. Используй ТОЛЬКО реальные колонки из документации схемы.\n"
-                    "Если ошибка связана с несуществующей колонкой — удали её или замени правильной.\n"
-                    "Верни ТОЛЬКО исправленный SQL без объяснений."
-                )
-
-            retry_prompt = f"""Запрос пользователя: {user_prompt}
-
-Предыдущий SQL:
-{failed_sql}
+            retry_prompt = _RETRY_TEMPLATE.format_map({
+                "user_prompt": user_prompt,
+                "failed_sql": failed_sql,
+                "error_message": error_message,
+                "tried_block": tried_block,
+                "real_columns_info": real_columns_info,
+                "instruction": _RETRY_EMPTY_INSTRUCTION if is_empty_result else _RETRY_ERROR_INSTRUCTION,
+            })
 
-Результат:
-{error_message}
-{tried_block}{real_columns_info}
-{instruction}"""
-
-            response = self.client.messages.create(
-                model=self.model,
-                system=system_text,
-                messages=[{"role": "user", "content": retry_prompt}],
-                temperature=0.0,
-                max_tokens=2000
-            )
+            if conversation_context:
+                retry_prompt = self._build_context_message(conversation_context) + "\n\n" + retry_prompt
 
-            sql_output = response.content[0].text.strip()
+            sql_output = self._complete(self._system_blocks(system_text), retry_prompt, model=model)
             sql_output = self._extract_sql_from_response(sql_output)
 
             logger.info("Corrected SQL generated successfully")
@@ -342,6 +769,140 @@ class SQLGenerator:
             logger.error("Failed to generate corrected SQL: %s", str(e))
             raise
 
+    def _system_blocks(self, dynamic_text: str) -> List[Dict[str, Any]]:
+        """
+        Build the system parameter with the static schema prompt marked for prompt caching.
+
+        The static prompt goes first as its own cached block, so every call shares
+        the same prefix; per-request text (date, context, discovery) follows it.
+
+        Args:
+            dynamic_text: Per-request system text
+
+        Returns:
+            List of system content blocks
+        """
+        self._prompt_in_use = True
+        blocks = [{"type": "text", "text": self.system_prompt, "cache_control": {"type": "ephemeral"}}]
+        if dynamic_text:
+            blocks.append({"type": "text", "text": dynamic_text})
+        return blocks
+
+    def _complete(self, system: Union[str, List[Dict[str, Any]]], user_content: str,
+                  max_tokens: int = 2000, model: str = None) -> str:
+        """
+        Run a single Claude completion and return its stripped text.
+
+        Identical requests that arrive while one is already in flight (e.g. the
+        same question from several Slack threads) wait for that call instead of
+        issuing their own.
+
+        The response is streamed; once a ```sql block has been closed the stream
+        is dropped, so trailing explanations are neither generated nor billed.
+
+        Args:
+            system: System prompt, as a string or a list of content blocks
+            user_content: User message
+            max_tokens: Max tokens to generate
+            model: Model override (defaults to self.model)
+
+        Returns:
+            Response text
+        """
+        model = model or self.model
+        if isinstance(system, str):
+            system_text = system
+        else:
+            # The static prompt is already hashed — don't rehash ~40KB per call
+            system_text = "\x00".join(
+                self.system_prompt_hash if b["text"] is self.system_prompt else b["text"] for b in system
+            )
+        key = "llm:" + hashlib.sha256(
+            f"{model}\x00{max_tokens}\x00{system_text}\x00{user_content}".encode("utf-8")
+        ).hexdigest()
+        return self._single_flight(key, lambda: self._stream_completion(system, user_content, max_tokens, model))
+
+    def _stream_completion(self, system: Union[str, List[Dict[str, Any]]], user_content: str,
+                           max_tokens: int, model: str) -> str:
+        """Stream one completion, stopping once the SQL block is closed. See _complete()."""
+        text = ""
+        sql_start = -1  # position right after the ```sql opener, once seen
+        started = time.perf_counter()
+        first_token_at = None
+        with self.client.messages.stream(
+            model=model,
+            system=system,
+            messages=[{"role": "user", "content": user_content}],
+            temperature=0.0,
+            max_tokens=max_tokens
+        ) as stream:
+            for delta in stream.text_stream:
+                # Fences may be split across deltas — rescan a few chars back
+                scan_from = max(0, len(text) - 8)
+                text += delta
+                if first_token_at is None and text.strip():
+                    first_token_at = time.perf_counter()
+                    logger.debug("LLM first token after %.0f ms", (first_token_at - started) * 1000)
+                if scan_from < 16 <= len(text) and _SQL_PREFIX_RE.match(text):
+                    logger.debug("Response streams raw SQL: %s", text[:16].strip())
+                if sql_start < 0:
+                    fence = _SQL_FENCE_RE.search(text, scan_from)
+                    if fence:
+                        sql_start = fence.end()
+                if sql_start >= 0 and text.find("\n```", max(sql_start, scan_from)) >= 0:
+                    logger.debug("SQL block closed — stopping response stream early")
+                    break
+            # Input usage arrives with message_start, so it's known even after an early stop
+            usage = stream.current_message_snapshot.usage
+
+        logger.info(
+            "LLM call (%s) finished in %.0f ms, first token after %.0f ms; "
+            "input tokens: %d uncached, %d cache read, %d cache write",
+            model, (time.perf_counter() - started) * 1000,
+            ((first_token_at or time.perf_counter()) - started) * 1000,
+            usage.input_tokens,
+            usage.cache_read_input_tokens or 0,
+            usage.cache_creation_input_tokens or 0
+        )
+        return text.strip()
+
+    def _single_flight(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        Run compute() unless a call with the same key is already running.
+
+        Concurrent callers with an identical key (e.g. the same question from
+        several Slack threads) wait for the running call and share its result
+        or exception instead of repeating the work.
+
+        Args:
+            key: Identity of the work
+            compute: Function doing the work
+
+        Returns:
+            Result of compute()
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_owner:
+            logger.info("Identical request already in flight — waiting for its result")
+            return future.result()
+
+        try:
+            result = compute()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
     def _build_context_message(self, ctx: dict) -> str:
         """
         Build conversation context message for follow-up SQL generation.
@@ -350,7 +911,7 @@ class SQLGenerator:
             ctx: Dict with previous_sql, previous_question, history
 
         Returns:
-            Context string to include in LLM messages
+            Context string to prepend to the user message
         """
         parts = ["КОНТЕКСТ ПРЕДЫДУЩЕГО РАЗГОВОРА:"]
 
@@ -360,12 +921,13 @@ class SQLGenerator:
         if ctx.get("previous_sql"):
             parts.append(f"Предыдущий SQL запрос:\n{ctx['previous_sql']}")
 
-        if ctx.get("history"):
-            parts.append("\nПоследние сообщения:")
-            for msg in ctx["history"][-3:]:
-                parts.append(f"  Пользователь: {msg['user_message']}")
-                if msg.get("sql_query"):
-                    parts.append(f"  SQL: {msg['sql_query'][:300]}")
+        # Older turns only as their questions: previous_sql already carries the useful SQL
+        earlier = [
+            msg["user_message"] for msg in (ctx.get("history") or [])[-3:]
+            if msg.get("user_message") and msg["user_message"] != ctx.get("previous_question")
+        ]
+        if earlier:
+            parts.append("Ранее спрашивали: " + " | ".join(earlier))
 
         parts.append(
             "\nЕсли текущий запрос является уточнением или продолжением предыдущего, "
@@ -375,19 +937,57 @@ class SQLGenerator:
 
         return "\n".join(parts)
 
+    def _is_simple_prompt(self, user_prompt: str, conversation_context: Optional[dict]) -> bool:
+        """
+        Heuristic: can the cheaper fast_model handle this question?
+
+        Follow-ups, long prompts and prompts hinting at joins, exclusions or
+        comparisons stay on the main model.
+
+        Args:
+            user_prompt: Natural language question
+            conversation_context: Conversation context, if the prompt is a follow-up
+
+        Returns:
+            True if fast_model is configured and the prompt looks simple
+        """
+        return bool(
+            self.fast_model
+            and not conversation_context
+            and len(user_prompt) <= self.SIMPLE_PROMPT_MAX_CHARS
+            and not _COMPLEX_PROMPT_RE.search(user_prompt)
+        )
+
+    @staticmethod
+    def _looks_like_new_topic(user_prompt: str) -> bool:
+        """
+        Heuristic: does the prompt start a new independent request?
+
+        Args:
+            user_prompt: Natural language question
+
+        Returns:
+            True if the prompt opens like a standalone request and has no
+            references to the previous turn
+        """
+        return bool(_NEW_TOPIC_RE.match(user_prompt)) and not _ANAPHORA_RE.search(user_prompt)
+
     def _extract_sql_from_response(self, response: str) -> str:
         """
-        Extract SQL query from OpenAI response, handling markdown code blocks.
+        Extract SQL query from Claude response, handling markdown code blocks.
 
         Args:
-            response: Raw response from OpenAI
+            response: Raw response from Claude
 
         Returns:
             Clean SQL query string
         """
+        # The prompt asks for raw SQL, so a fence-free response is used as is
+        if "```" not in response:
+            return response
+
         # Try to extract SQL from markdown code block (```sql ... ```)
-        sql_pattern = r'```sql\s*\n(.*?)\n```'
-        match = re.search(sql_pattern, response, re.DOTALL | re.IGNORECASE)
+        match = _SQL_BLOCK_RE.search(response)
 
         if match:
             sql = match.group(1).strip()
@@ -424,123 +1024,42 @@ class SQLGenerator:
 
     def _generate_system_prompt(self, schema_docs: Dict[str, Any]) -> str:
         """Generate comprehensive system prompt from schema documentation."""
-        prompt = """Ты — SELECT SQL-бот для базы данных Hero's Journey.
-
-        ПРАВИЛА:
-        1. Генерируй ТОЛЬКО валидный SELECT SQL без комментариев
-        2. Используй ТОЛЬКО документированные таблицы и поля
-        3. Учитывай timezone Asia/Almaty для всех дат
-        4. Для связи таблиц используй указанные relationships
-        5. Колонка "user" обязательно должна использвться с двойными кавычками "user"
-        6. Запрещены: DROP, DELETE, UPDATE, INSERT, ALTER, TRUNCATE
-
-        ⚠️ КРИТИЧЕСКИ ВАЖНО — НИКОГДА НЕ ВОЗВРАЩАЙ ГОЛЫЕ ID:
-        - Если в результате есть FK-колонка (award, marathonevent, user, clan, event и т.д.) — ВСЕГДА делай JOIN чтобы получить человекочитаемое название
-        - Примеры:
-          ❌ SELECT award FROM useraward → возвращает "611208d4b8fd8d00172c81f0" — ЗАПРЕЩЕНО
-          ✅ SELECT ua.*, aw.name as award_name FROM ods_core.useraward ua LEFT JOIN ods_core.award aw ON ua.award = aw.id
-          ❌ SELECT marathonevent FROM useraward → возвращает голый ID
-          ✅ SELECT ua.*, me.name as marathon_name FROM ods_core.useraward ua LEFT JOIN ods_core.marathonevent me ON ua.marathonevent = me.id
-        - Если JOIN невозможен (таблица неизвестна), хотя бы включи name/title/description из основной таблицы
-        - Пользователь должен видеть НАЗВАНИЯ, не технические ID
-
-        ВАЖНО ДЛЯ НАЗВАНИЙ ПРОГРАММ:
-        - Пользователи могут писать названия программ на русском или в неформальном виде
-        - Ты ДОЛЖЕН конвертировать их в точные значения из allowed_values
-        - Используй таблицу синонимов программ ниже для правильного маппинга
-        - Римские цифры (I, II, III, IV) НЕ заменяй на арабские (1, 2, 3, 4) в SQL!
-
-        ПРАВИЛА ВЫБОРА СХЕМЫ:
-        - ods_core — основная схема для общих вопросов (пользователи, чекины, марафоны, платежи и т.д.)
-        - ris — только для вопросов про ретеншн (retention)
-        - stage — запасная схема, если в ods_core нет нужных данных
-        ⚠️ ЗАПРЕЩЕНО использовать olap_schema и raw!
-
-        ЧАСТЫЕ ОШИБКИ (НЕ ДЕЛАЙ):
-        ❌ Использовать поля из другой таблицы без JOIN
-        ❌ Выдумывать названия колонок
-        ❌ Использовать схему olap_schema или raw
-        ❌ Писать "Burn 1" вместо "Burn I"
-        ❌ Писать "Берн 1" вместо "Burn I"
-        ❌ Писать "Fit Body III" вместо "Fit body III"
-        ✅ Правильно: используй только задокументированные поля и точные названия из allowed_values
-
-        КРИТИЧЕСКИ ВАЖНО - ПРАВИЛА ЭКРАНИРОВАНИЯ PostgreSQL:
-        ⚠️ ОБЯЗАТЕЛЬНО используй двойные кавычки "" для зарезервированных слов PostgreSQL!
-
-        ВСЕГДА ЭКРАНИРУЙ ЭТИ ПОЛЯ:
-        - "user" - ВСЕГДА в кавычках (reserved word)
-        - "event" - ВСЕГДА в кавычках (reserved word)
-        - "group" - ВСЕГДА в кавычках (reserved word)
-        - "level" - ВСЕГДА в кавычках (reserved word)
-        - "status" - ВСЕГДА в кавычках (reserved word)
-        - "type" - ВСЕГДА в кавычках (reserved word)
-        - "comment" - ВСЕГДА в кавычках (reserved word)
-        - "name" - ВСЕГДА в кавычках (reserved word)
-        - "cost" - ВСЕГДА в кавычках (reserved word)
-        - "program" - ВСЕГДА в кавычках (reserved word)
-
-        ПРАВИЛА КАВЫЧЕК:
-        1. Двойные кавычки "" - для названий полей/таблиц (идентификаторов)
-        ✅ SELECT "user", "event" FROM booking
-        ❌ SELECT user, event FROM booking
-
-        2. Одинарные кавычки '' - для строковых значений
-        ✅ WHERE marathon_name = 'Burn I'
-        ❌ WHERE marathon_name = "Burn I"
-
-        3. Удваивай апостроф внутри строк
-        ✅ WHERE marathon_name = 'Hero''s Week'
-        ❌ WHERE marathon_name = 'Hero's Week'
-    """
-
-        # Add table descriptions
-        prompt += "\n=== ТАБЛИЦЫ ===\n"
+        parts = [_PROMPT_HEADER]
+        append = parts.append
+        glossary = schema_docs["glossary"]
+
+        # Add table descriptions as compact DDL; comments only for columns users refer to by synonyms
+        append("\n=== ТАБЛИЦЫ ===\n")
+        append("Формат: CREATE TABLE таблица (колонка тип, -- описание; syn: синонимы)\n")
+        append("Описания остальных колонок, подходящих к вопросу, — в блоке ОПИСАНИЯ КОЛОНОК\n")
         for table_name, table_data in schema_docs["tables"].items():
-            prompt += f"\nТаблица: {table_name}\n"
-            prompt += f"Описание: {table_data.get('description', '')}\n"
-            prompt += "Колонки:\n"
-            for col in table_data.get("columns", []):
-                prompt += f"  - {col['name']} ({col['type']}): {col.get('description', '')}\n"
-                if "synonyms_ru" in col:
-                    prompt += f"    Синонимы: {', '.join(col['synonyms_ru'])}\n"
-
-        # Add business terms
-        prompt += "\n=== БИЗНЕС-ТЕРМИНЫ ===\n"
-        for term in schema_docs["glossary"].get("business_terms", []):
-            prompt += f"\n{term.get('canonical', '')}: {term.get('definition', '')}\n"
-            prompt += f"Синонимы: {', '.join(term.get('synonyms_ru', []))}\n"
-            if "sql_logic" in term:
-                prompt += f"SQL логика: {term['sql_logic']}\n"
+            append(f"\nCREATE TABLE {table_name} (  -- {table_data.get('description', '')}\n")
+            columns = table_data.get("columns", ())
+            last = len(columns) - 1
+            for i, col in enumerate(columns):
+                name, ctype, synonyms = col["name"], col["type"], col.get("synonyms_ru")
+                sep = "," if i < last else ""
+                if synonyms is not None:
+                    append(f"  {name} {ctype}{sep}  -- {col.get('description', '')}; syn: {', '.join(synonyms)}\n")
+                else:
+                    append(f"  {name} {ctype}{sep}\n")
+            append(");\n")
+
+        # Business terms, other column descriptions, examples and name synonyms
+        # are retrieved per question, see _retrieve_schema_context()
 
         # Add program name mappings
-        prompt += "\n=== МАППИНГ НАЗВАНИЙ ПРОГРАММ ===\n"
-        prompt += "ВАЖНО: Пользователи могут писать названия программ по-разному.\n"
-        prompt += "Конвертируй их в ТОЧНЫЕ канонические значения из этого списка:\n\n"
-        for prog in schema_docs["glossary"].get("program_name_mappings", []):
-            canonical = prog.get('canonical', '')
-            synonyms = prog.get('synonyms', [])
-            prompt += f"Каноническое: '{canonical}'\n"
-            prompt += f"  Синонимы: {', '.join(synonyms)}\n"
-            prompt += f"  → В SQL используй ТОЧНО: '{canonical}'\n\n"
+        append("\n=== МАППИНГ НАЗВАНИЙ ПРОГРАММ ===\n")
+        append("ВАЖНО: Пользователи могут писать названия программ по-разному.\n")
+        append("Конвертируй их в ТОЧНЫЕ канонические значения из этого списка:\n")
+        programs = glossary.get("program_name_mappings", ())
+        append(", ".join(f"'{prog.get('canonical', '')}'" for prog in programs) + "\n")
 
         # Add club name mappings
-        prompt += "\n=== МАППИНГ НАЗВАНИЙ КЛУБОВ ===\n"
-        prompt += "ВАЖНО: Пользователи могут писать названия клубов/филиалов по-разному.\n"
-        prompt += "Конвертируй их в ТОЧНЫЕ канонические значения:\n\n"
-        club_mappings = schema_docs["glossary"].get("club_name_mappings", {})
-        for club in club_mappings.get("mappings", []):
-            canonical = club.get('canonical', '')
-            synonyms = club.get('synonyms', [])
-            prompt += f"Каноническое: '{canonical}'\n"
-            prompt += f"  Синонимы: {', '.join(synonyms)}\n"
-            prompt += f"  → В SQL используй ТОЧНО: '{canonical}'\n\n"
-
-        # Add examples
-        prompt += "\n=== ПРИМЕРЫ ЗАПРОСОВ ===\n"
-        for example in schema_docs["examples"][:10]:
-            prompt += f"\nВопрос: {example.get('question_ru', '')}\n"
-            if "sql" in example and "statement" in example["sql"]:
-                prompt += f"SQL:\n{example['sql']['statement']}\n"
+        append("\n=== МАППИНГ НАЗВАНИЙ КЛУБОВ ===\n")
+        append("ВАЖНО: Пользователи могут писать названия клубов/филиалов по-разному.\n")
+        append("Конвертируй их в ТОЧНЫЕ канонические значения:\n")
+        clubs = glossary.get("club_name_mappings", {}).get("mappings", ())
+        append(", ".join(f"'{club.get('canonical', '')}'" for club in clubs) + "\n")
 
-        return prompt
+        return "".join(parts)
@@ -1,9 +1,14 @@
 """
 Enrich historical user data with real names from Slack API.
 """
-import requests
+import json
+import os
+import time
+from pathlib import Path
+from psycopg2.extras import execute_values
 from core.database import DatabaseManager
 from config import Config
+from utils.slack_http import slack_session, slack_post
 
 # Initialize database
 db = DatabaseManager(
@@ -14,23 +19,76 @@ db = DatabaseManager(
     port=Config.DB_PORT
 )
 
-print("Fetching all users from Slack workspace...")
+# Keep-alive session to Slack; rate limits are handled by slack_post()
+session = slack_session(Config.SLACK_BOT_TOKEN)
 
-# Fetch all users from Slack
-response = requests.post(
-    "https://slack.com/api/users.list",
-    headers={"Authorization": f"Bearer {Config.SLACK_BOT_TOKEN}"},
-    timeout=10
-)
+# Slack members are cached on disk between runs (only the staged fields, mode 0600)
+MEMBERS_CACHE_PATH = Path.home() / ".cache" / "hj-mcp" / "slack_members.json"
+MEMBERS_CACHE_TTL = 24 * 3600
+
+
+def fetch_all_members():
+    """Fetch every workspace member, following users.list pagination."""
+    members = []
+    cursor = None
+    while True:
+        payload = {"limit": 200}
+        if cursor:
+            payload["cursor"] = cursor
+        # users.list is a Tier 2 method (~20 calls/min); large workspaces page into its limit
+        data = slack_post(session, "users.list", data=payload)
+
+        if not data.get('ok'):
+            print(f"Error fetching users: {data.get('error')}")
+            exit(1)
+
+        members.extend(data.get('members', []))
+        cursor = data.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return members
+
+
+def member_row(member):
+    """Pick the fields the staging table needs from a users.list member."""
+    profile = member.get('profile', {})
+    return (
+        member.get('id'),
+        member.get('name', 'unknown'),
+        member.get('real_name', 'unknown'),
+        profile.get('email'),
+        profile.get('display_name', member.get('name', 'unknown')),
+        member.get('is_admin', False),
+        member.get('is_bot', False)
+    )
 
-data = response.json()
 
-if not data.get('ok'):
-    print(f"Error fetching users: {data.get('error')}")
-    exit(1)
+def save_members_cache(rows):
+    """Write the member rows to the cache file, readable by the current user only."""
+    MEMBERS_CACHE_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    fd = os.open(MEMBERS_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # O_CREAT's mode only applies to new files; tighten one left by an older version too
+    os.chmod(MEMBERS_CACHE_PATH, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False)
 
-members = data.get('members', [])
-print(f"Found {len(members)} users in Slack workspace")
+
+stage_rows = None
+if MEMBERS_CACHE_PATH.exists() and time.time() - MEMBERS_CACHE_PATH.stat().st_mtime < MEMBERS_CACHE_TTL:
+    try:
+        cached = json.loads(MEMBERS_CACHE_PATH.read_text(encoding='utf-8'))
+        # Older versions cached full member objects keyed by ID; refetch those
+        if isinstance(cached, list):
+            stage_rows = [tuple(row) for row in cached]
+            print(f"Loaded {len(stage_rows)} Slack users from cache {MEMBERS_CACHE_PATH}")
+    except ValueError as e:
+        print(f"[WARN] Ignoring unreadable members cache: {e}")
+
+if stage_rows is None:
+    print("Fetching all users from Slack workspace...")
+    # Keyed by ID, so a member listed twice is staged once
+    stage_rows = list({row[0]: row for row in map(member_row, fetch_all_members())}.values())
+    print(f"Found {len(stage_rows)} users in Slack workspace")
+    save_members_cache(stage_rows)
 
 # Get users from database that need enrichment
 result = db.execute_query("""
@@ -42,57 +100,48 @@ result = db.execute_query("""
 db_users = result['slack_user_id'].tolist()
 print(f"Found {len(db_users)} users in database that need enrichment")
 
-# Enrich each user
-updated = 0
-not_found = 0
-
-for user_id in db_users:
-    # Find user in Slack members
-    slack_user = None
-    for member in members:
-        if member.get('id') == user_id:
-            slack_user = member
-            break
-
-    if slack_user:
-        profile = slack_user.get('profile', {})
-
-        # Update in database
-        sql = """
-            UPDATE analytics.bot_users
+# Stage Slack members in a temp table and enrich all matching users in one UPDATE ... FROM
+with db.get_connection() as conn:
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE slack_members_stage (
+                id text PRIMARY KEY,
+                name text,
+                real_name text,
+                email text,
+                display_name text,
+                is_admin boolean,
+                is_bot boolean
+            ) ON COMMIT DROP
+        """)
+        execute_values(cur, "INSERT INTO slack_members_stage VALUES %s", stage_rows, page_size=1000)
+        cur.execute("""
+            UPDATE analytics.bot_users u
             SET
-                slack_username = %s,
-                real_name = %s,
-                email = %s,
-                display_name = %s,
-                is_admin = %s,
-                is_bot = %s,
+                slack_username = s.name,
+                real_name = s.real_name,
+                email = s.email,
+                display_name = s.display_name,
+                is_admin = s.is_admin,
+                is_bot = s.is_bot,
                 updated_at = NOW()
-            WHERE slack_user_id = %s
-        """
-
-        try:
-            with db.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(sql, (
-                        slack_user.get('name', 'unknown'),
-                        slack_user.get('real_name', 'unknown'),
-                        profile.get('email'),
-                        profile.get('display_name', slack_user.get('name', 'unknown')),
-                        slack_user.get('is_admin', False),
-                        slack_user.get('is_bot', False),
-                        user_id
-                    ))
-                    conn.commit()
-                    updated += 1
-                    print(f"[OK] Updated {user_id}: {slack_user.get('real_name')}")
-        except Exception as e:
-            print(f"[ERROR] Error updating {user_id}: {e}")
-    else:
-        not_found += 1
-        print(f"[WARN] User {user_id} not found in Slack workspace")
+            FROM slack_members_stage s
+            WHERE u.slack_user_id = s.id
+              AND (u.slack_username = 'historical' OR u.real_name = 'Historical User')
+            RETURNING u.slack_user_id, s.real_name
+        """)
+        updated_rows = cur.fetchall()
+    conn.commit()
+
+for user_id, real_name in updated_rows:
+    print(f"[OK] Updated {user_id}: {real_name}")
+
+updated_ids = {user_id for user_id, _ in updated_rows}
+missing = [user_id for user_id in db_users if user_id not in updated_ids]
+for user_id in missing:
+    print(f"[WARN] User {user_id} not found in Slack workspace")
 
 print(f"\n=== Results ===")
-print(f"Updated: {updated}")
-print(f"Not found: {not_found}")
+print(f"Updated: {len(updated_rows)}")
+print(f"Not found: {len(missing)}")
 print("\nDone!")
@@ -1,11 +1,13 @@
 """
 Fetch message history from Slack channels to recover user_message data.
 """
-import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 from datetime import datetime
+from psycopg2.extras import execute_values
 from core.database import DatabaseManager
 from config import Config
+from utils.slack_http import slack_session, slack_post
 
 # Force unbuffered output
 sys.stdout.reconfigure(line_buffering=True)
@@ -19,14 +21,12 @@ db = DatabaseManager(
     port=Config.DB_PORT
 )
 
+# Keep-alive session shared by the worker threads (pool covers MAX_WORKERS)
+session = slack_session(Config.SLACK_BOT_TOKEN)
+
 # First, test Slack API token and scopes
 print("Testing Slack API token and scopes...")
-test_response = requests.post(
-    "https://slack.com/api/auth.test",
-    headers={"Authorization": f"Bearer {Config.SLACK_BOT_TOKEN}"},
-    timeout=10
-)
-test_data = test_response.json()
+test_data = slack_post(session, "auth.test")
 if test_data.get('ok'):
     print(f"[OK] Token valid for workspace: {test_data.get('team')}")
     print(f"[OK] Bot user: {test_data.get('user')}")
@@ -35,102 +35,166 @@ else:
     sys.exit(1)
 
 # Get all historical interactions that need user_message
-print("\nQuerying database for interactions without user_message...")
-result = db.execute_query("""
-    SELECT
-        id,
-        slack_user_id,
-        channel_id,
-        created_at,
-        user_message
-    FROM analytics.bot_interactions
-    WHERE user_message IS NULL
-    ORDER BY created_at
-""")
-
-print(f"Found {len(result)} interactions without user_message")
-print("\nFetching Slack message history...\n")
-sys.stdout.flush()
-
 updated_count = 0
 error_count = 0
 not_found_count = 0
+processed_count = 0
+
+# Concurrent Slack API calls; conversations.history is I/O-bound
+MAX_WORKERS = 12
+# Rows read ahead of the workers; bounds memory while the DB scan streams
+MAX_PENDING = MAX_WORKERS * 4
+# Recovered messages are written and committed in batches of this size, so memory
+# stays bounded and an interrupted run keeps what it already fetched
+UPDATE_BATCH_SIZE = 1000
+
+
+def fetch_user_message(record):
+    """
+    Fetch the message a user posted around the interaction time.
+
+    Args:
+        record: (interaction_id, user_id, channel_id, created_at) tuple
 
-for idx, row in result.iterrows():
-    interaction_id = row['id']
-    user_id = row['slack_user_id']
-    channel_id = row['channel_id']
-    created_at = row['created_at']
+    Returns:
+        (status, user_message_or_error, message_count) where status is 'ok', 'not_found' or 'error'
+    """
+    interaction_id, user_id, channel_id, created_at = record
 
     # Convert timestamp to Slack format (Unix timestamp)
     ts_start = int(created_at.timestamp()) - 5  # 5 seconds before
     ts_end = int(created_at.timestamp()) + 5    # 5 seconds after
 
-    print(f"[{idx+1}/{len(result)}] [{interaction_id}] Channel {channel_id}, User {user_id}, Time {created_at}")
-    sys.stdout.flush()
+    data = slack_post(
+        session,
+        "conversations.history",
+        json={
+            "channel": channel_id,
+            "oldest": str(ts_start),
+            "latest": str(ts_end),
+            "limit": 10
+        }
+    )
 
-    try:
-        # Fetch conversation history
-        response = requests.post(
-            "https://slack.com/api/conversations.history",
-            headers={"Authorization": f"Bearer {Config.SLACK_BOT_TOKEN}"},
-            json={
-                "channel": channel_id,
-                "oldest": str(ts_start),
-                "latest": str(ts_end),
-                "limit": 10
-            },
-            timeout=10
-        )
+    if not data.get('ok'):
+        return 'error', data.get('error'), 0
+
+    messages = data.get('messages', [])
+
+    # Find message from this user
+    for msg in messages:
+        if msg.get('user') == user_id and msg.get('text'):
+            return 'ok', msg.get('text'), len(messages)
+
+    return 'not_found', None, len(messages)
+
+
+def report_result(record, future):
+    """
+    Print the outcome of one fetch.
 
-        data = response.json()
+    Returns:
+        (status, user_message) where status is 'ok', 'not_found' or 'error'
+    """
+    interaction_id, user_id, channel_id, created_at = record
+    print(f"[{processed_count + 1}] [{interaction_id}] Channel {channel_id}, User {user_id}, Time {created_at}")
 
-        if not data.get('ok'):
-            error = data.get('error')
-            print(f"  [ERROR] API error: {error}")
-            if error == 'missing_scope':
-                print(f"  [INFO] Need scope: channels:history, groups:history, im:history, mpim:history")
+    try:
+        status, payload, message_count = future.result()
+    except Exception as e:
+        print(f"  [ERROR] Exception: {e}")
+        return 'error', None
+
+    if status == 'error':
+        print(f"  [ERROR] API error: {payload}")
+        if payload == 'missing_scope':
+            print(f"  [INFO] Need scope: channels:history, groups:history, im:history, mpim:history")
+        return 'error', None
+
+    print(f"  Found {message_count} messages in time range")
+    if status == 'ok':
+        print(f"  [OK] Found message (length: {len(payload)})")
+    else:
+        print(f"  [WARN] No message from this user")
+    return status, payload
+
+
+def drain(pending, return_when):
+    """Wait for pending fetches (dict future -> record) and record their outcomes."""
+    global processed_count, error_count, not_found_count
+    done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        record = pending.pop(future)
+        status, user_message = report_result(record, future)
+        processed_count += 1
+        if status == 'ok':
+            updates.append((record[0], user_message))
+        elif status == 'error':
             error_count += 1
-            sys.stdout.flush()
-            continue
-
-        messages = data.get('messages', [])
-        print(f"  Found {len(messages)} messages in time range")
-        sys.stdout.flush()
-
-        # Find message from this user
-        user_message = None
-        for msg in messages:
-            if msg.get('user') == user_id and msg.get('text'):
-                user_message = msg.get('text')
-                print(f"  [OK] Found message (length: {len(user_message)})")
-                sys.stdout.flush()
-                break
-
-        if user_message:
-            # Update database
-            with db.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "UPDATE analytics.bot_interactions SET user_message = %s WHERE id = %s",
-                        (user_message, interaction_id)
-                    )
-                    conn.commit()
-            print(f"  [OK] Updated DB")
-            updated_count += 1
-            sys.stdout.flush()
         else:
-            print(f"  [WARN] No message from this user")
             not_found_count += 1
-            sys.stdout.flush()
 
-    except Exception as e:
-        print(f"  [ERROR] Exception: {e}")
-        error_count += 1
-        sys.stdout.flush()
+
+def flush_updates(write_conn):
+    """Write the recovered messages collected so far and commit them."""
+    global updated_count
+    if not updates:
+        return
+    with write_conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            UPDATE analytics.bot_interactions AS bi
+            SET user_message = v.user_message
+            FROM (VALUES %s) AS v(id, user_message)
+            WHERE bi.id = v.id
+            """,
+            updates,
+            page_size=UPDATE_BATCH_SIZE
+        )
+    write_conn.commit()
+    updated_count += len(updates)
+    print(f"[OK] Saved {len(updates)} messages to DB ({updated_count} so far)")
+    updates.clear()
+
+
+updates = []
+
+print("\nStreaming interactions without user_message from database...")
+print("Fetching Slack message history...\n")
+sys.stdout.flush()
+
+# Server-side cursor streams rows, so Slack calls start with the first batch
+# instead of after the whole table is loaded; updates go through a second
+# connection, since committing would close the cursor
+with db.get_connection() as conn, db.get_connection() as write_conn, \
+        ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    pending = {}  # future -> record
+
+    try:
+        with conn.cursor(name='fetch_slack_history') as cur:
+            cur.itersize = 1000
+            cur.execute("""
+                SELECT id, slack_user_id, channel_id, created_at
+                FROM analytics.bot_interactions
+                WHERE user_message IS NULL
+                ORDER BY created_at
+            """)
+            for record in cur:
+                pending[executor.submit(fetch_user_message, record)] = record
+                if len(pending) >= MAX_PENDING:
+                    drain(pending, FIRST_COMPLETED)
+                    if len(updates) >= UPDATE_BATCH_SIZE:
+                        flush_updates(write_conn)
+
+        if pending:
+            drain(pending, ALL_COMPLETED)
+    finally:
+        # Save what was recovered even if the run is interrupted (e.g. Ctrl-C)
+        flush_updates(write_conn)
 
 print(f"\n=== Summary ===")
-print(f"Total processed: {len(result)}")
+print(f"Total processed: {processed_count}")
 print(f"Successfully updated: {updated_count}")
 print(f"Not found: {not_found_count}")
 print(f"Errors: {error_count}")
@@ -1,8 +1,11 @@
 """
 Import historical bot queries from logs into analytics.bot_interactions table.
 """
+import mmap
+import os
 import re
 from datetime import datetime
+from psycopg2.extras import execute_values
 from core.database import DatabaseManager
 from config import Config
 
@@ -19,36 +22,45 @@ db = DatabaseManager(
 log_file = r'C:\Users\daule\Downloads\bot_queries.log'
 
 # Parse pattern: Dec 01 06:56:54 ... Processing query from user U08NW5WKP37 in channel D09LB0D10KG
-pattern = r'(\w+ \d+ \d+:\d+:\d+).*Processing query from user ([A-Z0-9]+) in channel ([A-Z0-9]+)'
+# Bytes pattern run over the whole mmapped file; '.' doesn't cross newlines, so matches stay within a line
+pattern = re.compile(rb'(\w+ \d+ \d+:\d+:\d+).*?Processing query from user ([A-Z0-9]+) in channel ([A-Z0-9]+)')
+
+# Log lines have no year; assume the current one
+YEAR = datetime.now().year
+
+
+def iter_log_matches(path):
+    """Yield query log matches from the mmapped file; an empty file (which mmap can't map) has none."""
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from pattern.finditer(mm)
+
 
 interactions = []
 
 print("Parsing log file...")
-with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
-    for line in f:
-        match = re.search(pattern, line)
-        if match:
-            timestamp_str = match.group(1)
-            user_id = match.group(2)
-            channel_id = match.group(3)
-
-            # Parse timestamp (add current year)
-            try:
-                year = datetime.now().year
-                timestamp = datetime.strptime(f'{year} {timestamp_str}', '%Y %b %d %H:%M:%S')
-            except Exception as e:
-                print(f"Error parsing timestamp '{timestamp_str}': {e}")
-                timestamp = datetime.now()
-
-            # Create session_id
-            session_id = f"{user_id}_{channel_id}_{timestamp.strftime('%Y%m%d')}"
-
-            interactions.append({
-                'session_id': session_id,
-                'slack_user_id': user_id,
-                'channel_id': channel_id,
-                'created_at': timestamp
-            })
+for match in iter_log_matches(log_file):
+    timestamp_str = match.group(1).decode('ascii', errors='replace')
+    user_id = match.group(2).decode('ascii')
+    channel_id = match.group(3).decode('ascii')
+
+    # Parse timestamp (add current year)
+    try:
+        timestamp = datetime.strptime(f'{YEAR} {timestamp_str}', '%Y %b %d %H:%M:%S')
+    except Exception as e:
+        print(f"Error parsing timestamp '{timestamp_str}': {e}")
+        timestamp = datetime.now()
+
+    # Create session_id
+    session_id = f"{user_id}_{channel_id}_{timestamp.strftime('%Y%m%d')}"
+
+    interactions.append({
+        'session_id': session_id,
+        'slack_user_id': user_id,
+        'channel_id': channel_id,
+        'created_at': timestamp
+    })
 
 print(f"Found {len(interactions)} historical interactions")
 
@@ -61,47 +73,40 @@ print("\nCreating users in bot_users table...")
 user_sql = """
     INSERT INTO analytics.bot_users (
         slack_user_id, slack_username, real_name, first_seen_at
-    ) VALUES (%s, %s, %s, %s)
+    ) VALUES %s
     ON CONFLICT (slack_user_id) DO NOTHING
 """
 
-for user_id in unique_users:
-    try:
-        with db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(user_sql, (user_id, 'historical', 'Historical User', interactions[0]['created_at']))
-                conn.commit()
-    except Exception as e:
-        print(f"Error creating user {user_id}: {e}")
-
-# Now insert interactions
+# Now insert interactions; duplicates are skipped by the unique constraints
 sql = """
     INSERT INTO analytics.bot_interactions (
         session_id, slack_user_id, channel_id, created_at
-    ) VALUES (%s, %s, %s, %s)
+    ) VALUES %s
+    ON CONFLICT DO NOTHING
+    RETURNING 1
 """
 
 inserted = 0
-skipped = 0
 
-print("\nInserting interactions into database...")
-for interaction in interactions:
-    try:
-        with db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, (
-                    interaction['session_id'],
-                    interaction['slack_user_id'],
-                    interaction['channel_id'],
-                    interaction['created_at']
-                ))
-                conn.commit()
-                inserted += 1
-    except Exception as e:
-        # Skip duplicates or errors
-        skipped += 1
-        if 'duplicate' not in str(e).lower():
-            print(f"Error: {e}")
+# One connection and one commit for the whole import, rows sent in pages
+with db.get_connection() as conn:
+    with conn.cursor() as cur:
+        first_seen = interactions[0]['created_at'] if interactions else None
+        execute_values(
+            cur, user_sql,
+            [(user_id, 'historical', 'Historical User', first_seen) for user_id in unique_users],
+            page_size=1000
+        )
+
+        print("\nInserting interactions into database...")
+        rows = [
+            (i['session_id'], i['slack_user_id'], i['channel_id'], i['created_at'])
+            for i in interactions
+        ]
+        inserted = len(execute_values(cur, sql, rows, page_size=1000, fetch=True))
+    conn.commit()
+
+skipped = len(interactions) - inserted
 
 print(f"\n=== Results ===")
 print(f"Total parsed: {len(interactions)}")
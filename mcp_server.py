@@ -4,6 +4,9 @@ Exposes database querying capabilities via Model Context Protocol.
 Returns results as text tables only (no Excel) for optimal performance.
 """
 import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from mcp.server.models import InitializationOptions
 from mcp.server import NotificationOptions, Server
@@ -13,32 +16,78 @@ from mcp import types
 from config import Config
 from core import SchemaLoader, SQLGenerator, DatabaseManager
 from utils.logger import setup_logger
+from utils.table_format import format_table
+from utils.sql_guard import check_select_sql
 
 # Setup logging
 logger = setup_logger(__name__, Config.LOG_LEVEL)
 
-# Validate configuration
-try:
-    Config.validate()
-    logger.info("MCP Server configuration validated")
-except ValueError as e:
-    logger.error("Configuration error: %s", str(e))
-    raise
-
-# Initialize core components
-schema_loader = SchemaLoader(Config.DOCS_DIR)
-schema_docs = schema_loader.load_all()
-
-sql_generator = SQLGenerator(Config.OPENAI_API_KEY, Config.OPENAI_MODEL)
-sql_generator.set_schema(schema_docs)
-
-db_manager = DatabaseManager(
-    host=Config.DB_HOST,
-    dbname=Config.DB_NAME,
-    user=Config.DB_USER,
-    password=Config.DB_PASSWORD,
-    port=Config.DB_PORT
-)
+# Core components are created on first use, so spawning the MCP process stays cheap;
+# main() validates the configuration before serving. Tools resolve them in worker
+# threads (loading docs and building the prompt take a while), hence the lock
+_init_lock = threading.RLock()
+_db_init_lock = threading.Lock()
+_schema_loader = None
+_sql_generator = None
+_db_manager = None
+_schema_texts = None  # (table name -> markdown, index markdown)
+
+
+def _get_schema_loader() -> SchemaLoader:
+    """Load schema documentation on first use."""
+    global _schema_loader
+    with _init_lock:
+        if _schema_loader is None:
+            loader = SchemaLoader(Config.DOCS_DIR, Config.SCHEMA_CACHE_PATH)
+            loader.load_all()
+            _schema_loader = loader
+    return _schema_loader
+
+
+def _get_sql_generator() -> SQLGenerator:
+    """Create the SQL generator on first use."""
+    global _sql_generator
+    with _init_lock:
+        if _sql_generator is None:
+            schema_loader = _get_schema_loader()
+            generator = SQLGenerator(
+                Config.ANTHROPIC_API_KEY, Config.ANTHROPIC_MODEL,
+                Config.ANTHROPIC_RETRY_MODEL, Config.ANTHROPIC_FAST_MODEL
+            )
+            generator.set_schema(schema_loader.schema, schema_loader.get_signature())
+            _sql_generator = generator
+    return _sql_generator
+
+
+def _get_db_manager() -> DatabaseManager:
+    """Create the database manager on first use."""
+    global _db_manager
+    # Own lock: this is resolved on the event loop and must not wait for a prompt build
+    with _db_init_lock:
+        if _db_manager is None:
+            _db_manager = DatabaseManager(
+                host=Config.DB_HOST,
+                dbname=Config.DB_NAME,
+                user=Config.DB_USER,
+                password=Config.DB_PASSWORD,
+                port=Config.DB_PORT,
+                pool_max_size=Config.DB_POOL_MAX_SIZE
+            )
+    return _db_manager
+
+
+# Database work gets its own threads, one per pooled connection, so slow LLM calls
+# in the default executor never hold up queries (threads start on first use)
+_db_executor = ThreadPoolExecutor(max_workers=Config.DB_POOL_MAX_SIZE, thread_name_prefix="mcp-db")
+
+
+async def _run_db(func, *args):
+    """Run blocking database work on the database executor."""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, func, *args)
+
+
+# Rows shown in a text table; larger results are cut in the database query
+MAX_DISPLAY_ROWS = 200  # Увеличили лимит для текстовых таблиц
 
 # Initialize MCP server
 server = Server(Config.MCP_SERVER_NAME)
@@ -46,6 +95,89 @@ server = Server(Config.MCP_SERVER_NAME)
 logger.info("MCP Server initialized: %s v%s", Config.MCP_SERVER_NAME, Config.MCP_SERVER_VERSION)
 
 
+# Tool definitions are static; build them once instead of on every list_tools call
+_TOOLS: list[types.Tool] = [
+    types.Tool(
+        name="query_database",
+        description="""Query the Hero's Journey database using natural language.
+
+        This tool accepts questions in Russian or English and:
+        1. Generates optimized SQL query
+        2. Executes query against PostgreSQL database
+        3. Returns results as formatted text table (fast and efficient)
+
+        Available data:
+        - User subscriptions (heropass)
+        - Marathon participation (usermarathonevent)
+        - Bookings and check-ins
+        - Payments
+        - Notifications
+
+        Examples:
+        - "Show users whose subscription expires in the next 7 days"
+        - "How many users completed Hero's Week marathon?"
+        - "List all payments for Burn I program"
+
+        Note: For Excel exports, use the Slack bot instead.
+        """,
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "question": {
+                    "type": "string",
+                    "description": "Natural language question about Hero's Journey data (Russian or English)"
+                }
+            },
+            "required": ["question"]
+        }
+    ),
+    types.Tool(
+        name="execute_sql",
+        description="""Execute a specific SQL SELECT query against Hero's Journey database.
+
+        Use this when you already have a SQL query and want to execute it directly.
+        Only SELECT queries are allowed. The query must use ods_core, stage, or ris schema prefix for tables.
+
+        Returns query results as formatted text table.
+
+        Note: For Excel exports, use the Slack bot instead.
+        """,
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "sql": {
+                    "type": "string",
+                    "description": "SQL SELECT query to execute (must start with SELECT)"
+                }
+            },
+            "required": ["sql"]
+        }
+    ),
+    types.Tool(
+        name="get_schema_info",
+        description="""Get information about available database tables and their structure.
+
+        Returns documentation about:
+        - Available tables in the database
+        - Column names and types
+        - Business terms and their meanings
+        - Relationships between tables
+
+        Use this to understand what data is available before querying.
+        """,
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "table_name": {
+                    "type": "string",
+                    "description": "Optional: specific table name to get detailed info. If not provided, lists all tables."
+                }
+            }
+        }
+    )
+]
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """
@@ -53,86 +185,7 @@ async def handle_list_tools() -> list[types.Tool]:
 
     Returns list of tools that can query the Hero's Journey database.
     """
-    return [
-        types.Tool(
-            name="query_database",
-            description="""Query the Hero's Journey database using natural language.
-
-            This tool accepts questions in Russian or English and:
-            1. Generates optimized SQL query
-            2. Executes query against PostgreSQL database
-            3. Returns results as formatted text table (fast and efficient)
-
-            Available data:
-            - User subscriptions (heropass)
-            - Marathon participation (usermarathonevent)
-            - Bookings and check-ins
-            - Payments
-            - Notifications
-
-            Examples:
-            - "Show users whose subscription expires in the next 7 days"
-            - "How many users completed Hero's Week marathon?"
-            - "List all payments for Burn I program"
-
-            Note: For Excel exports, use the Slack bot instead.
-            """,
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "question": {
-                        "type": "string",
-                        "description": "Natural language question about Hero's Journey data (Russian or English)"
-                    }
-                },
-                "required": ["question"]
-            }
-        ),
-        types.Tool(
-            name="execute_sql",
-            description="""Execute a specific SQL SELECT query against Hero's Journey database.
-
-            Use this when you already have a SQL query and want to execute it directly.
-            Only SELECT queries are allowed. The query must use ods_core, stage, or ris schema prefix for tables.
-
-            Returns query results as formatted text table.
-
-            Note: For Excel exports, use the Slack bot instead.
-            """,
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "sql": {
-                        "type": "string",
-                        "description": "SQL SELECT query to execute (must start with SELECT)"
-                    }
-                },
-                "required": ["sql"]
-            }
-        ),
-        types.Tool(
-            name="get_schema_info",
-            description="""Get information about available database tables and their structure.
-
-            Returns documentation about:
-            - Available tables in the database
-            - Column names and types
-            - Business terms and their meanings
-            - Relationships between tables
-
-            Use this to understand what data is available before querying.
-            """,
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "table_name": {
-                        "type": "string",
-                        "description": "Optional: specific table name to get detailed info. If not provided, lists all tables."
-                    }
-                }
-            }
-        )
-    ]
+    return _TOOLS
 
 
 @server.call_tool()
@@ -167,33 +220,25 @@ async def query_database_tool(arguments: dict) -> list[types.TextContent]:
     if not question:
         raise ValueError("Question is required")
 
-    logger.info("Processing natural language query: %s", question[:100])
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Processing natural language query: %s", question[:100])
 
-    # Generate SQL
-    sql_query = sql_generator.generate_query(question)
+    # Generate SQL (the first call also loads the docs and builds the prompt, off the loop)
+    sql_generator = await asyncio.to_thread(_get_sql_generator)
+    sql_query = await sql_generator.generate_query_async(question)
     logger.info("Generated SQL query")
 
-    # Execute query
-    df = db_manager.execute_query(sql_query)
-
-    # Format response
-    result_text = f"**Generated SQL:**\n```sql\n{sql_query}\n```\n\n"
-
-    # Check if DataFrame is empty
-    if df is None or df.empty:
-        result_text += "**Result:** No data returned (query executed successfully but returned empty result)"
-        return [types.TextContent(type="text", text=result_text)]
-
-    result_text += f"**Result:** {len(df)} rows × {len(df.columns)} columns\n\n"
-
-    # Return as formatted table (ALWAYS)
-    max_display_rows = 200  # Увеличили лимит для текстовых таблиц
-    result_text += "```\n" + df.to_string(index=False, max_rows=max_display_rows) + "\n```"
-
-    if len(df) > max_display_rows:
-        result_text += f"\n\n*(Showing first {max_display_rows} of {len(df)} rows. For full dataset, use Slack bot.)*"
+    # Execute query in a database thread so the event loop keeps serving other tool calls;
+    # fetch one row past the display limit to know whether there is more
+    try:
+        columns, rows = await _run_db(_get_db_manager().execute_query_limited, sql_query, MAX_DISPLAY_ROWS + 1)
+    except Exception:
+        # generate_query() answers paraphrases from its cache; don't hand out SQL that fails
+        sql_generator.forget_sql(sql_query)
+        raise
 
-    return [types.TextContent(type="text", text=result_text)]
+    return _format_result("Generated SQL", sql_query, columns, rows,
+                          "No data returned (query executed successfully but returned empty result)")
 
 
 async def execute_sql_tool(arguments: dict) -> list[types.TextContent]:
@@ -203,81 +248,139 @@ async def execute_sql_tool(arguments: dict) -> list[types.TextContent]:
     if not sql:
         raise ValueError("SQL query is required")
 
-    # Validate it's a SELECT query
-    if not sql.strip().upper().startswith("SELECT"):
-        raise ValueError("Only SELECT queries are allowed")
+    # Reject anything but a single SELECT statement before handing off to a worker thread
+    check_select_sql(sql)
 
-    logger.info("Executing SQL query: %s", sql[:100])
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Executing SQL query: %s", sql[:100])
 
-    # Execute query
-    df = db_manager.execute_query(sql)
+    # Execute query in a database thread so the event loop keeps serving other tool calls;
+    # fetch one row past the display limit to know whether there is more
+    columns, rows = await _run_db(_get_db_manager().execute_query_limited, sql, MAX_DISPLAY_ROWS + 1)
 
-    # Format response
-    result_text = f"**Executed SQL:**\n```sql\n{sql}\n```\n\n"
+    return _format_result("Executed SQL", sql, columns, rows, "No data returned")
 
-    # Check if DataFrame is empty
-    if df is None or df.empty:
-        result_text += "**Result:** No data returned"
-        return [types.TextContent(type="text", text=result_text)]
 
-    result_text += f"**Result:** {len(df)} rows × {len(df.columns)} columns\n\n"
+def _format_result(title: str, sql: str, columns: list, rows: list, empty_text: str) -> list[types.TextContent]:
+    """
+    Build the tool response: the SQL, a result summary and the rows as a text table.
 
-    # Return as table (ALWAYS)
-    max_display_rows = 200  # Увеличили лимит для текстовых таблиц
-    result_text += "```\n" + df.to_string(index=False, max_rows=max_display_rows) + "\n```"
+    Args:
+        title: Heading for the SQL block
+        sql: Executed SQL
+        columns: Column names
+        rows: Row tuples, at most MAX_DISPLAY_ROWS + 1 (the extra one marks a cut result)
+        empty_text: Result line for an empty result
 
-    if len(df) > max_display_rows:
-        result_text += f"\n\n*(Showing first {max_display_rows} of {len(df)} rows. For full dataset, use Slack bot.)*"
+    Returns:
+        Single-element list with the response text
+    """
+    parts = [f"**{title}:**\n```sql\n{sql}\n```\n\n"]
 
-    return [types.TextContent(type="text", text=result_text)]
+    # Check if result is empty
+    if not rows:
+        parts.append(f"**Result:** {empty_text}")
+        return [types.TextContent(type="text", text="".join(parts))]
 
+    truncated = len(rows) > MAX_DISPLAY_ROWS
+    shown_rows = MAX_DISPLAY_ROWS if truncated else len(rows)
+    parts.append(f"**Result:** {shown_rows}{'+' if truncated else ''} rows × {len(columns)} columns\n\n")
 
-async def get_schema_info_tool(arguments: dict) -> list[types.TextContent]:
-    """Handle schema information requests."""
-    table_name = arguments.get("table_name")
+    # Return as formatted table (ALWAYS)
+    parts += ["```\n", format_table(rows, columns, MAX_DISPLAY_ROWS), "\n```"]
 
-    if table_name:
-        # Get specific table info
-        table_info = schema_loader.get_table_info(table_name)
+    if truncated:
+        parts.append(
+            f"\n\n*(Showing first {MAX_DISPLAY_ROWS} rows; more are available. For full dataset, use Slack bot.)*"
+        )
+
+    return [types.TextContent(type="text", text="".join(parts))]
+
+
+def _render_table_md(table_name: str, table_info: dict) -> str:
+    """Render one table's documentation as markdown."""
+    result = f"# Table: {table_info.get('table', table_name)}\n\n"
+    result += f"**Description:** {table_info.get('description', 'N/A')}\n\n"
+    result += "## Columns:\n\n"
+
+    for col in table_info.get('columns', []):
+        result += f"- **{col['name']}** ({col['type']}): {col.get('description', '')}\n"
+        if 'synonyms_ru' in col:
+            result += f"  - Synonyms: {', '.join(col['synonyms_ru'])}\n"
 
-        if not table_info:
-            return [types.TextContent(
-                type="text",
-                text=f"Table '{table_name}' not found in schema documentation."
-            )]
+    return result
 
-        result = f"# Table: {table_info.get('table', table_name)}\n\n"
-        result += f"**Description:** {table_info.get('description', 'N/A')}\n\n"
-        result += "## Columns:\n\n"
 
-        for col in table_info.get('columns', []):
-            result += f"- **{col['name']}** ({col['type']}): {col.get('description', '')}\n"
-            if 'synonyms_ru' in col:
-                result += f"  - Synonyms: {', '.join(col['synonyms_ru'])}\n"
+def _render_index_md(schema_loader: SchemaLoader, tables: list) -> str:
+    """Render the list of all documented tables as markdown."""
+    result = f"# Hero's Journey Database Schema\n\n"
+    result += f"**Total tables:** {len(tables)}\n\n"
+    result += "## Available Tables:\n\n"
 
-        return [types.TextContent(type="text", text=result)]
-    else:
-        # List all tables
-        tables = schema_loader.get_table_names()
+    for table in tables:
+        table_info = schema_loader.get_table_info(table)
+        result += f"- **{table}**: {table_info.get('description', 'N/A')}\n"
 
-        result = f"# Hero's Journey Database Schema\n\n"
-        result += f"**Total tables:** {len(tables)}\n\n"
-        result += "## Available Tables:\n\n"
+    result += "\n*Use `get_schema_info` with a specific table_name to see detailed column information.*"
+    return result
 
-        for table in tables:
-            table_info = schema_loader.get_table_info(table)
-            result += f"- **{table}**: {table_info.get('description', 'N/A')}\n"
 
-        result += "\n*Use `get_schema_info` with a specific table_name to see detailed column information.*"
+def _get_schema_texts() -> tuple:
+    """
+    Render every get_schema_info answer once; schema docs don't change while the server runs.
+
+    Returns:
+        Tuple of (dict table name -> markdown, markdown index of all tables)
+    """
+    global _schema_texts
+    with _init_lock:
+        if _schema_texts is None:
+            schema_loader = _get_schema_loader()
+            tables = schema_loader.get_table_names()
+            per_table = {
+                name: _render_table_md(name, schema_loader.get_table_info(name))
+                for name in tables
+                if schema_loader.get_table_info(name)
+            }
+            _schema_texts = (per_table, _render_index_md(schema_loader, tables))
+    return _schema_texts
 
-        return [types.TextContent(type="text", text=result)]
+
+async def get_schema_info_tool(arguments: dict) -> list[types.TextContent]:
+    """Handle schema information requests."""
+    table_name = arguments.get("table_name")
+    per_table, index_text = await asyncio.to_thread(_get_schema_texts)
+
+    if table_name:
+        # Get specific table info
+        text = per_table.get(table_name)
+        if text is None:
+            text = f"Table '{table_name}' not found in schema documentation."
+        return [types.TextContent(type="text", text=text)]
+
+    # List all tables
+    return [types.TextContent(type="text", text=index_text)]
 
 
 async def main():
     """Run the MCP server."""
     logger.info("Starting MCP server...")
 
-    # Database connection will be tested on first query
+    # Validate configuration
+    try:
+        Config.validate()
+        logger.info("MCP Server configuration validated")
+    except ValueError as e:
+        logger.error("Configuration error: %s", str(e))
+        raise
+
+    # LLM generation runs via asyncio.to_thread and takes seconds per call; size the
+    # default executor for it (the stock one may be as small as 5 threads)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=Config.MCP_WORKER_THREADS, thread_name_prefix="mcp-tool")
+    )
+
+    # Schema docs, the LLM client and the database pool are set up on first tool call
     # to avoid blocking server startup
 
     async with stdio_server() as (read_stream, write_stream):
@@ -2,5 +2,8 @@
 Utility modules for logging and helpers.
 """
 from .logger import setup_logger
+from .table_format import format_table
+from .sql_guard import check_select_sql
+from .slack_http import slack_session, slack_post
 
-__all__ = ['setup_logger']
+__all__ = ['setup_logger', 'format_table', 'check_select_sql', 'slack_session', 'slack_post']
@@ -1,10 +1,46 @@
 """
 Logging configuration for the application.
 """
+import atexit
 import logging
+import queue
 import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+# All loggers hand records to one queue; a background thread writes them to stderr,
+# so logging never blocks the caller (e.g. the MCP event loop) on stderr I/O
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener():
+    """Start the shared stderr writer thread on first use."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        # Windows consoles default to a legacy code page that can't encode Cyrillic;
+        # switch stderr to UTF-8 once instead of failing per record
+        if sys.platform == "win32" and hasattr(sys.stderr, "reconfigure"):
+            sys.stderr.reconfigure(encoding="utf-8", errors="replace")
+
+        # Console handler with formatting (use stderr for MCP compatibility)
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+
+        _listener = QueueListener(_log_queue, handler)
+        _listener.start()
+        # Flush queued records before the interpreter exits
+        atexit.register(_listener.stop)
+
+
 def setup_logger(name: str, log_level: str = "INFO") -> logging.Logger:
     """
     Setup and configure logger with consistent formatting.
@@ -22,18 +58,13 @@ def setup_logger(name: str, log_level: str = "INFO") -> logging.Logger:
     if logger.handlers:
         return logger
 
+    _start_listener()
+
     logger.setLevel(getattr(logging, log_level.upper()))
 
-    # Console handler with formatting (use stderr for MCP compatibility)
-    handler = logging.StreamHandler(sys.stderr)
+    handler = QueueHandler(_log_queue)
     handler.setLevel(getattr(logging, log_level.upper()))
 
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    handler.setFormatter(formatter)
-
     logger.addHandler(handler)
 
     return logger
@@ -0,0 +1,59 @@
+"""
+HTTP access to the Slack Web API for the maintenance scripts.
+"""
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SLACK_API_URL = "https://slack.com/api/"
+# Tier 2-3 methods (users.list, conversations.history) answer bursts with 429s
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+def slack_session(token: str, pool_size: int = 16) -> requests.Session:
+    """
+    Create a persistent HTTPS session to Slack.
+
+    Connections are kept alive and 5xx responses retried (the Slack methods the
+    scripts call are read-only, so retrying POST is safe). 429s are left to
+    slack_post(), which waits as long as Slack's Retry-After asks.
+
+    Args:
+        token: Slack bot token
+        pool_size: Max connections kept open, at least the number of calling threads
+
+    Returns:
+        Session authorized with the token
+    """
+    session = requests.Session()
+    session.headers.update({"Authorization": f"Bearer {token}"})
+    session.mount("https://", HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                          allowed_methods=frozenset({"POST"}), respect_retry_after_header=False)
+    ))
+    return session
+
+
+def slack_post(session: requests.Session, method: str, **kwargs) -> dict:
+    """
+    Call a Slack Web API method, waiting out rate limits.
+
+    Args:
+        session: Session from slack_session()
+        method: API method name, e.g. "users.list"
+        **kwargs: Passed to session.post() (data/json payload; timeout defaults to 10 s)
+
+    Returns:
+        Decoded JSON response (check its "ok" field)
+    """
+    kwargs.setdefault("timeout", 10)
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        response = session.post(SLACK_API_URL + method, **kwargs)
+        if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+            break
+        # Rate limited: honour Retry-After, backing off exponentially on top
+        time.sleep(max(int(response.headers.get("Retry-After", 1)), 2 ** attempt))
+    return response.json()
@@ -0,0 +1,109 @@
+"""
+Validation of user-supplied SQL before it reaches the database.
+"""
+import re
+
+# Start of a comment, quoted string, quoted identifier or dollar-quoted string
+_QUOTE_OR_COMMENT_RE = re.compile(r"""--|/\*|(?<!\w)[eE]'|'|"|\$(?:[A-Za-z_]\w*)?\$""")
+# Rest of a standard string literal ('' escapes a quote)
+_STRING_END_RE = re.compile(r"(?:[^']|'')*'")
+# Rest of an E'' string literal (backslash escapes too)
+_ESCAPE_STRING_END_RE = re.compile(r"(?:[^'\\]|''|\\.)*'", re.DOTALL)
+# Rest of a quoted identifier ("" escapes a quote)
+_IDENT_END_RE = re.compile(r'(?:[^"]|"")*"')
+# Leading keyword of the statement, after any opening parentheses
+_FIRST_KEYWORD_RE = re.compile(r'[\s(]*([A-Za-z]+)')
+
+_ALLOWED_KEYWORDS = frozenset({"SELECT", "WITH"})
+
+
+def _skip_block_comment(sql: str, pos: int) -> int:
+    """Return the position after a (possibly nested) /* */ comment whose body starts at pos."""
+    depth = 1
+    while depth:
+        close = sql.find("*/", pos)
+        if close < 0:
+            raise ValueError("Unterminated comment in SQL")
+        nested = sql.find("/*", pos, close)
+        if nested >= 0:
+            depth += 1
+            pos = nested + 2
+        else:
+            depth -= 1
+            pos = close + 2
+    return pos
+
+
+def _mask_sql(sql: str) -> str:
+    """
+    Blank out comments and quoted text, keeping every offset in place.
+
+    What remains is bare SQL code, where every ';' really separates statements.
+    """
+    parts = []
+    pos = 0
+    while True:
+        match = _QUOTE_OR_COMMENT_RE.search(sql, pos)
+        if not match:
+            parts.append(sql[pos:])
+            return "".join(parts)
+        parts.append(sql[pos:match.start()])
+        token = match.group()
+
+        if token == "--":
+            end = sql.find("\n", match.end())
+            pos = len(sql) if end < 0 else end
+            parts.append(" " * (pos - match.start()))
+            continue
+        if token == "/*":
+            pos = _skip_block_comment(sql, match.end())
+            parts.append(" " * (pos - match.start()))
+            continue
+
+        if token[0] == "$":
+            close = sql.find(token, match.end())
+            end = close + len(token) if close >= 0 else -1
+        else:
+            if token == "'":
+                end_match = _STRING_END_RE.match(sql, match.end())
+            elif token == '"':
+                end_match = _IDENT_END_RE.match(sql, match.end())
+            else:
+                end_match = _ESCAPE_STRING_END_RE.match(sql, match.end())
+            end = end_match.end() if end_match else -1
+        if end < 0:
+            raise ValueError("Unterminated quoted text in SQL")
+        pos = end
+        parts.append("?" * (pos - match.start()))
+
+
+def check_select_sql(sql: str) -> str:
+    """
+    Make sure SQL is a single SELECT (or WITH ... SELECT) statement.
+
+    The text is scanned with Postgres quoting rules (strings, E-strings, quoted
+    identifiers, dollar quotes, nested comments), so a ';' inside a literal is
+    fine while "SELECT 1; DROP TABLE t" is rejected before any round-trip.
+    Whether a WITH query modifies data is left to a read-only transaction.
+
+    Args:
+        sql: SQL text supplied by a user or generated by the LLM
+
+    Returns:
+        The statement up to its terminating ';' (if any), without surrounding whitespace
+
+    Raises:
+        ValueError: If the text is not exactly one SELECT/WITH statement
+    """
+    masked = _mask_sql(sql)
+    statement_end = masked.find(";")
+    if statement_end < 0:
+        statement_end = len(masked)
+    elif masked[statement_end:].strip("; \t\r\n"):
+        raise ValueError("Only a single SQL statement is allowed")
+
+    keyword = _FIRST_KEYWORD_RE.match(masked)
+    if not keyword or keyword.group(1).upper() not in _ALLOWED_KEYWORDS:
+        raise ValueError("Only SELECT queries are allowed")
+
+    return sql[:statement_end].strip()
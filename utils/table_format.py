@@ -0,0 +1,40 @@
+"""
+Plain-text table formatting for query results.
+"""
+from itertools import islice
+from typing import Any, Iterable, Sequence
+
+
+def _format_value(value: Any) -> str:
+    """Render one cell on a single line; floats keep every significant digit."""
+    if value is None:
+        return "None"
+    if isinstance(value, float):
+        return "NaN" if value != value else repr(value)
+    return str(value).replace("\n", " ")
+
+
+def format_table(rows: Iterable[Sequence[Any]], columns: Sequence[str], max_rows: int = 200) -> str:
+    """
+    Format rows as a right-aligned text table (like DataFrame.to_string(index=False)).
+
+    Args:
+        rows: Row tuples, in column order
+        columns: Column names
+        max_rows: Max number of rows to render; the rest are not read
+
+    Returns:
+        Table text: header line followed by one line per row
+    """
+    cells = [[_format_value(v) for v in row] for row in islice(rows, max_rows)]
+    header = [str(c) for c in columns]
+
+    widths = [len(h) for h in header]
+    for row in cells:
+        for i, cell in enumerate(row):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+
+    lines = [" ".join(h.rjust(w) for h, w in zip(header, widths))]
+    lines.extend(" ".join(cell.rjust(w) for cell, w in zip(row, widths)) for row in cells)
+    return "\n".join(lines)